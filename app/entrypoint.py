@@ -1,14 +1,18 @@
 import os
+import itertools
+import json
 import logging
 
-from flask import Flask, request, jsonify, redirect, make_response
+from flask import Flask, Response, request, jsonify, redirect, make_response
 from waitress import serve
 from firebase_admin import auth
 from functools import wraps
 
-from lib.bundle_generator import BundleGenerator
-from lib.firebase_handler import FirebaseHandler
+from lib.bundle_store import BUNDLE_MIMETYPE
 from lib.flags import FlagHandler
+from lib.response_encoding import choose_encoding, compress_chunks
+from lib.handler_registry import HandlerRegistry
+from app.routes.flag_redirects import CACHELESS_HEADERS, FlagRedirectMiddleware
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -16,6 +20,14 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 FLAG_HANDLER = FlagHandler()
+HANDLER_REGISTRY = HandlerRegistry()
+# Set up the current year's db client at startup rather than on first request
+HANDLER_REGISTRY.warm_up()
+# How long a client may reuse a stored bundle before revalidating
+BUNDLE_MAX_AGE = int(os.environ.get('BUNDLE_MAX_AGE', 60))
+# Without a bundle store nothing tells the app a bundle is out of date, so
+# the bundles it builds per request are only reused briefly
+UNSTORED_BUNDLE_MAX_AGE = int(os.environ.get('UNSTORED_BUNDLE_MAX_AGE', 10))
 
 def verify_firebase_token(f):
     @wraps(f)
@@ -38,11 +50,54 @@ def verify_firebase_token(f):
 def generate_cacheless_redirect_response(redirect_url):
     """Create redirect response with no-cache headers"""
     response = make_response(redirect(redirect_url, code=302))
-    response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-    response.headers['Pragma'] = 'no-cache'
-    response.headers['Expires'] = '0'
+    response.headers.extend(CACHELESS_HEADERS)
     return response
 
+def generate_streamed_response(chunks, mimetype):
+    """Create a chunked response from an iterable of bytes, compressed with
+    brotli or gzip if the client accepts it"""
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding:
+        chunks = compress_chunks(chunks, encoding)
+    response = Response(chunks, mimetype=mimetype)
+    # Never buffer the whole body, e.g. to work out a Content-Length
+    response.implicit_sequence_conversion = False
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+def generate_stored_bundle_response(bundle_generator, stored, chunks):
+    """Create a cacheable response for a bundle from
+    BundleGenerator.open_bundle, which is a 304 if the client already has
+    it"""
+    response = generate_streamed_response(chunks, BUNDLE_MIMETYPE)
+    # Each encoding is a different byte sequence, so needs its own tag
+    encoding = response.headers.get('Content-Encoding')
+    if encoding:
+        response.set_etag(f'{stored.etag}-{encoding}')
+    else:
+        response.set_etag(stored.etag)
+        response.content_length = stored.size
+    # Bundles need a token, so only the client's own cache may keep them
+    response.cache_control.private = True
+    response.cache_control.max_age = BUNDLE_MAX_AGE \
+        if bundle_generator.store is not None else UNSTORED_BUNDLE_MAX_AGE
+    return response.make_conditional(request)
+
+def iter_all_bundles_json(result):
+    """Serialize generate_all_bundles' result one bundle at a time, as each
+    is generated, so neither the response nor every bundle has to be held
+    at once"""
+    message = json.dumps(f'Generated {result["total_bundles"]} bundle files')
+    yield (f'{{"success": true, "message": {message}, "result": '
+           f'{{"total_bundles": {result["total_bundles"]}, '
+           f'"regenerated_bundles": {result["regenerated_bundles"]}, '
+           f'"bundles": [').encode()
+    for i, bundle in enumerate(result['bundles']):
+        yield ((', ' if i else '') + json.dumps(bundle)).encode()
+    yield b']}}'
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Simple health check endpoint."""
@@ -59,25 +114,14 @@ def generate_bundle():
         return jsonify({'error': 'collection_path is required'}), 400
     
     try:
-        firebase_handler = FirebaseHandler()
-        bundle_generator = BundleGenerator(firebase_handler)
+        bundle_generator = HANDLER_REGISTRY.get_bundle_generator()
         
-        bundle_data = bundle_generator.generate_bundle(collection_path)
-        
-        # # Decide whether to save file or return JSON based on the request
-        # if data.get('save_bundle', False):
-        #     output_dir = data.get('output_dir')
-        #     filepath = bundle_generator.save_bundle(bundle_data, collection_path, output_dir)
-        #     return jsonify({
-        #         'success': True,
-        #         'message': f'Bundle saved to {filepath}',
-        #         'filepath': filepath,
-        #         'bundle_name': collection_path.replace('/', '_'),
-        #         'size': len(str(bundle_data).encode('utf-8')),
-        #         'document_count': bundle_data["metadata"]["totalDocuments"]
-        #     }), 200
-        # else:
-        return jsonify(bundle_data), 200
+        # Pull the first chunk here so Firestore errors still become a 500
+        # rather than a broken stream
+        chunks = bundle_generator.stream_bundle(collection_path)
+        first_chunk = next(chunks, b'')
+        return generate_streamed_response(
+            itertools.chain([first_chunk], chunks), BUNDLE_MIMETYPE), 200
             
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -91,20 +135,75 @@ def generate_all_bundles():
     
     try:
         year = data.get('year')
-        firebase_handler = FirebaseHandler(year=year)
-        bundle_generator = BundleGenerator(firebase_handler)
+        if year is not None and not HANDLER_REGISTRY.is_catalog_year(year):
+            return jsonify({'error': 'Unknown year'}), 400
+        bundle_generator = HANDLER_REGISTRY.get_bundle_generator(year)
+
+        if data.get('combined', False):
+            # One bundle for the whole year, with a named query per imp
+            chunks = bundle_generator.stream_bundle()
+            first_chunk = next(chunks, b'')
+            return generate_streamed_response(
+                itertools.chain([first_chunk], chunks), BUNDLE_MIMETYPE), 200
         
-        result = bundle_generator.generate_all_bundles()
-         
-        return jsonify({
-            'success': True,
-            'message': f'Generated {result["total_bundles"]} bundle files',
-            'result': result
-        }), 200
+        # Bundles for imps whose trophies haven't changed are reused unless
+        # the client asks for a full rebuild
+        result = bundle_generator.generate_all_bundles(
+            incremental=data.get('incremental', True))
+
+        # Pull the header and the first bundle here so Firestore errors
+        # still become a 500 rather than a broken stream
+        chunks = iter_all_bundles_json(result)
+        first_chunks = list(itertools.islice(chunks, 2))
+        return generate_streamed_response(
+            itertools.chain(first_chunks, chunks), 'application/json'), 200
             
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/bundles/<int:year>', methods=['GET'])
+@verify_firebase_token
+def serve_stored_year_bundle(year):
+    """
+    Serve the stored bundle of every imp's trophies for a year, building it
+    if needed.
+    """
+    try:
+        if not HANDLER_REGISTRY.is_catalog_year(year):
+            return jsonify({'error': 'Unknown year'}), 404
+
+        bundle_generator = HANDLER_REGISTRY.get_bundle_generator(year)
+        return generate_stored_bundle_response(
+            bundle_generator, *bundle_generator.open_bundle())
+
+    except Exception as e:
+        logger.error(f"Error serving year bundle: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/bundles/<int:year>/<imp_id>', methods=['GET'])
+@verify_firebase_token
+def serve_stored_bundle(year, imp_id):
+    """
+    Serve the stored bundle of an imp's trophies for a year, building it if
+    needed. Supports conditional requests, so unchanged bundles cost a 304.
+    """
+    try:
+        if not HANDLER_REGISTRY.is_catalog_year(year):
+            return jsonify({'error': 'Unknown year'}), 404
+
+        bundle_generator = HANDLER_REGISTRY.get_bundle_generator(year)
+        stored, chunks = bundle_generator.open_bundle(
+            f'imps/{imp_id}/trophies{year}')
+        if stored is None:
+            return jsonify({'error': 'Imp not found'}), 404
+
+        return generate_stored_bundle_response(
+            bundle_generator, stored, chunks)
+
+    except Exception as e:
+        logger.error(f"Error serving bundle: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/images/random-flag', methods=['GET'])
 def serve_random_flag():
     """
@@ -129,6 +228,13 @@ def serve_random_flag_with_creator():
         logger.error(f"Error redirecting to image with creator: {str(e)}")
         return jsonify({'error': 'Failed to redirect to image'}), 500
 
+# The flag routes below are served straight from pre-built responses; they
+# are only reached through Flask if picking a flag fails
+app.wsgi_app = FlagRedirectMiddleware(app.wsgi_app, FLAG_HANDLER, {
+    '/images/random-flag': False,
+    '/images/random-flag-with-creator': True,
+})
+
 if __name__ == '__main__':
     # Use PORT environment variable provided by Cloud Run, default to 8080
     port = int(os.environ.get('PORT', 8080))
@@ -0,0 +1,51 @@
+"""
+WSGI fast path for the random flag redirects, which get far more traffic
+than every other route put together.
+"""
+
+# Same headers as the Flask redirect responses
+CACHELESS_HEADERS = (
+    ('Cache-Control', 'no-store, no-cache, must-revalidate, max-age=0'),
+    ('Pragma', 'no-cache'),
+    ('Expires', '0'),
+)
+EMPTY_BODY = (b'',)
+
+class FlagRedirectMiddleware:
+    """
+    Answers GET requests for the random flag routes directly, without going
+    through Flask's request handling. Each flag URL's response headers are
+    built the first time it is served and reused after that. Everything
+    else, including errors picking a flag, is passed on to the wrapped app.
+    """
+    def __init__(self, app, flag_handler, paths):
+        """
+        Args:
+            app: the WSGI app to wrap
+            flag_handler: FlagHandler to pick flags from
+            paths: dict of route path -> whether to add the flag's creator
+        """
+        self.app = app
+        self.flag_handler = flag_handler
+        self.paths = paths
+        self._headers = {}
+
+    def __call__(self, environ, start_response):
+        with_creator = self.paths.get(environ.get('PATH_INFO'))
+        if with_creator is None or environ['REQUEST_METHOD'] != 'GET':
+            return self.app(environ, start_response)
+
+        try:
+            url = self.flag_handler.get_random_flag_url(with_creator)
+        except ValueError:
+            return self.app(environ, start_response)
+
+        headers = self._headers.get(url)
+        if headers is None:
+            headers = [('Location', url), ('Content-Length', '0'),
+                       *CACHELESS_HEADERS]
+            self._headers[url] = headers
+        # WSGI servers copy the headers rather than modifying them, so the
+        # same list can be handed out every time
+        start_response('302 FOUND', headers)
+        return EMPTY_BODY
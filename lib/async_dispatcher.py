@@ -0,0 +1,109 @@
+"""Asynchronous counterpart to Dispatcher, for making many requests to the
+forums at once from a single thread"""
+
+import importlib.util
+import time
+
+from lib.dispatcher import Dispatcher, DispatcherConfig, RetryPolicy
+from lib.rate_limiter import AdaptiveAsyncTokenBucket
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# httpx only speaks HTTP/2 with the h2 package installed; without it,
+# requests share keep-alive HTTP/1.1 connections instead.
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class AsyncDispatcher:
+    """Reads the same config as Dispatcher (pass a DispatcherConfig to share
+    one), but requests go through a pooled httpx.AsyncClient and are
+    awaited, so callers can overlap them. Requests are throttled by a token
+    bucket refilling at requests_per_second (adapting up to
+    max_requests_per_second as Dispatcher does), which lets up to
+    request_burst of them go out back to back. Failed requests are retried
+    with the same RetryPolicy as Dispatcher.
+
+    Use as an async context manager, or call aclose() when done.
+    """
+    SA_URL = Dispatcher.SA_URL
+    MAX_CONNECTIONS = 4
+
+    def __init__(self, settings=None, transport=None):
+        if httpx is None:
+            raise ImportError(
+                "httpx is required for AsyncDispatcher. Install it with "
+                "`pip install httpx[http2]`.")
+
+        self.settings = settings or DispatcherConfig()
+        self.config = self.settings.config
+        self.page_cache = self.settings.page_cache
+        self.archive = self.settings.archive
+        self.default_thread = self.settings.default_thread
+        self.logged_in = False
+        self.rate_limiter = AdaptiveAsyncTokenBucket(
+            self.settings.requests_per_second, self.settings.request_burst,
+            max_rate=self.settings.max_requests_per_second)
+        self.retry_policy = RetryPolicy(self.settings.max_retries)
+        # transport is only for swapping in a mock transport in tests
+        self.client = httpx.AsyncClient(
+            base_url=self.SA_URL,
+            http2=HTTP2_AVAILABLE and transport is None,
+            limits=httpx.Limits(max_connections=self.MAX_CONNECTIONS),
+            timeout=self.settings.request_timeout,
+            transport=transport)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    def check_sa_creds(self):
+        self.settings.check_sa_creds()
+
+    async def login(self, required=True):
+        if self.logged_in:
+            return
+
+        info = self.settings.login_form(required)
+        if info is None:
+            return
+
+        # The client keeps the session cookies for later requests
+        await self.client.post("account.php", data=info)
+        self.logged_in = True
+
+    async def get_thread(self, params=None, headers=None,
+                         allow_redirects=True):
+        """GET showthread.php, retrying as Dispatcher.get_thread does"""
+        attempt = 0
+        while True:
+            await self.rate_limiter.acquire()
+            started = time.monotonic()
+            try:
+                response = await self.client.get(
+                    "showthread.php", params=params, headers=headers,
+                    follow_redirects=allow_redirects)
+            except (httpx.TimeoutException, httpx.NetworkError) as error:
+                delay = self.retry_policy.retry_delay(attempt, error=error)
+                if delay is None:
+                    raise
+            else:
+                delay = self.retry_policy.retry_delay(attempt, response)
+                if delay is None:
+                    if not self.retry_policy.is_retryable(response):
+                        self.rate_limiter.record_response(
+                            time.monotonic() - started)
+                    return response
+
+            self.rate_limiter.back_off(delay)
+            attempt += 1
+
+    def save_config(self):
+        self.settings.save()
@@ -0,0 +1,164 @@
+"""Asynchronous counterpart to Thread, for reading threads through an
+AsyncDispatcher"""
+
+import asyncio
+from collections import deque
+
+from lib.thread_reader import BaseThread, Page, scrape_last_read_index, \
+    scrape_page_number
+
+
+class AsyncThread(BaseThread):
+    """Reads a thread like Thread does, with every request awaited. Create
+    one with `await AsyncThread.open(dispatcher=..., thread_id=...)`.
+
+    Several pages can be in flight at once, and several threads can be read
+    concurrently on one dispatcher; its token bucket keeps the combined
+    request rate polite.
+    """
+
+    @classmethod
+    async def open(cls, *, dispatcher, thread_id):
+        thread = cls(dispatcher=dispatcher, thread_id=thread_id)
+        thread.last_read_index = await thread.get_last_read_index()
+        thread.set_name(await thread.get_thread_name())
+        await thread.set_last_read()
+        return thread
+
+    async def load_previous_stopping_point(self):
+        if not self.load_saved_stopping_point():
+            await self.load_end_of_thread()
+            self.update_config_values()
+
+    async def load_end_of_thread(self):
+        self.page_number = await self.get_last_page_number()
+        self.last_post = await self.get_last_post()
+        await self.set_last_read()
+
+    async def get_posts_left_til_snipe(self):
+        await self.load_end_of_thread()
+        return self.POSTS_PER_PAGE - self.last_post
+
+    async def get_thread_name(self):
+        return self.read_thread_name(await self.get_raw_page(1))
+
+    async def get_raw_page(self, page_number, headers=None):
+        return await self.dispatcher.get_thread(
+            params=self.page_params(page_number), headers=headers)
+
+    async def get_page_html(self, page_number):
+        """Get a page's HTML, using the page cache as Thread does"""
+        if self.dispatcher.page_cache is None:
+            return (await self.get_raw_page(page_number)).text
+
+        cached = self.get_cached_page(page_number)
+        if cached and cached.complete:
+            return cached.html
+
+        response = await self.get_raw_page(
+            page_number,
+            headers=cached.revalidation_headers() if cached else None)
+        return self.page_html_from_response(page_number, response, cached)
+
+    async def get_page(self, page_number=None):
+        page_number = self.page_number if page_number is None else page_number
+        return self.parse_page(
+            page_number, await self.get_page_html(page_number))
+
+    async def get_last_page_number(self):
+        payload = {"threadid": self.thread, "goto": "lastpost"}
+        response = await self.dispatcher.get_thread(
+            params=payload, allow_redirects=False)
+        return scrape_page_number(response)
+
+    async def get_last_post(self):
+        raw_page = await self.get_page_html(self.page_number)
+        return len(Page(raw_page, self.parser_engine).posts)
+
+    async def fetch_raw_pages(self, first_page, last_page, concurrency):
+        """Fetch pages first_page..last_page with up to concurrency requests
+        in flight, yielding (page number, html) in thread order."""
+        page_numbers = iter(range(first_page, last_page + 1))
+        pending = deque()
+
+        def submit_next():
+            page_number = next(page_numbers, None)
+            if page_number is not None:
+                pending.append((page_number, asyncio.ensure_future(
+                    self.get_page_html(page_number))))
+
+        try:
+            for _ in range(concurrency):
+                submit_next()
+
+            while pending:
+                page_number, task = pending.popleft()
+                raw_page = await task
+                submit_next()
+                yield page_number, raw_page
+        finally:
+            for _page_number, task in pending:
+                task.cancel()
+
+    async def iter_pages(self, concurrency=1):
+        """Yield (page number, Page) from the current page to the end of the
+        thread. With concurrency above one, the last page number is resolved
+        up front and pages are downloaded ahead of the consumer."""
+        if concurrency > 1:
+            last_page_number = await self.get_last_page_number()
+            raw_pages = self.fetch_raw_pages(
+                self.page_number, last_page_number, concurrency)
+            try:
+                async for page_number, raw_page in raw_pages:
+                    page = self.parse_page(page_number, raw_page)
+                    if not page:
+                        return
+                    yield page_number, page
+            finally:
+                await raw_pages.aclose()
+            return
+
+        page_number = self.page_number
+        while True:
+            page = await self.get_page(page_number)
+            if not page:
+                # Last page of thread reached, has 40 posts
+                return
+
+            yield page_number, page
+            if self.is_last_page(page):
+                return
+
+            page_number += 1
+
+    async def iter_new_posts(self, concurrency=1, save_progress=True):
+        """Yield new posts from the current stopping point, advancing it as
+        Thread.iter_new_posts does."""
+        found_posts = False
+        async for page_number, page in self.iter_pages(concurrency):
+            posts = self.new_posts_on_page(page)
+            found_posts = found_posts or bool(posts)
+            for post in posts:
+                yield post
+            self.advance_past_page(page_number, page)
+
+        self.finish_reading(found_posts, save_progress)
+        await self.set_last_read()
+
+    async def new_posts(self, concurrency=1):
+        return [post async for post in self.iter_new_posts(concurrency)]
+
+    async def get_last_read_index(self):
+        """See Thread.get_last_read_index"""
+        if not self.dispatcher.logged_in:
+            return None
+
+        response = await self.dispatcher.get_thread(
+            params={"threadid": self.thread, "goto": "newpost"},
+            allow_redirects=False)
+        return scrape_last_read_index(response)
+
+    async def set_last_read(self):
+        params = self.set_last_read_params()
+        if params:
+            await self.dispatcher.get_thread(params=params)
@@ -1,71 +1,284 @@
 import os
+import io
 import json
-from datetime import datetime
-from firebase_admin import firestore
-from google.cloud.firestore_v1 import DocumentSnapshot
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from tempfile import SpooledTemporaryFile
+from google.cloud.firestore_bundle import (
+    BundledDocumentMetadata,
+    BundledQuery,
+    BundleElement,
+    BundleMetadata,
+    NamedQuery,
+)
+from google.cloud.firestore_v1 import _helpers
+from google.protobuf import json_format
 import pytz
 
+from lib.bundle_store import (
+    StoredBundle, bundle_name, hash_file, make_bundle_store)
+
+
 class BundleGenerator:
+    BUNDLE_VERSION = 1
+    # Bundles bigger than this are spooled to a temp file while being built
+    SPOOL_MAX_BYTES = 1024 * 1024
+    CHUNK_BYTES = 64 * 1024
+
     def __init__(self, firebase_handler):
         self.firebase = firebase_handler
         self.db = self.firebase.db_client
         self.output_dir = os.environ.get('BUNDLE_OUTPUT_DIR', 'bundles')
+        # How many collections to stream from Firestore at once
+        self.max_workers = int(os.environ.get('BUNDLE_CONCURRENCY', 8))
         self.club_timezone = pytz.timezone('US/Eastern')
+        # Where built bundles are kept for serving until their trophies
+        # change, or None to build them on every request
+        self.store = make_bundle_store()
 
-    def create_bundle_metadata(self) -> dict:
+    @staticmethod
+    def encode_element(element: BundleElement) -> bytes:
+        """Serialize a bundle element, prefixed with its length in bytes."""
+        serialized = json.dumps(
+            json_format.MessageToDict(element._pb)).encode('utf-8')
+        return str(len(serialized)).encode('ascii') + serialized
+
+    def create_bundle_metadata(self, bundle_id: str, total_documents: int,
+                               total_bytes: int) -> BundleMetadata:
         """Create metadata for the bundle."""
+        return BundleMetadata(
+            id=bundle_id,
+            create_time=_helpers.build_timestamp(),
+            version=self.BUNDLE_VERSION,
+            total_documents=total_documents,
+            total_bytes=total_bytes,
+        )
+
+    def create_named_query(self, name: str, query, read_time) -> NamedQuery:
+        """Create a named query from a Firestore query."""
+        parent_path, _prefix = query._parent._parent_info()
+        return NamedQuery(
+            name=name,
+            bundled_query=BundledQuery(
+                parent=parent_path,
+                structured_query=query._to_protobuf()._pb,
+                limit_type=BundledQuery.LimitType.FIRST,
+            ),
+            read_time=_helpers.build_timestamp(read_time),
+        )
+
+    def write_documents(self, docs, query_names, out) -> tuple:
+        """
+        Write a documentMetadata and document element for each doc.
+        query_names(doc) gives the names of the queries each doc belongs to.
+
+        Returns:
+            The number of documents written and the latest read time
+        """
+        count = 0
+        read_time = None
+        for doc in docs:
+            out.write(self.encode_element(BundleElement(
+                document_metadata=BundledDocumentMetadata(
+                    name=doc.reference._document_path,
+                    read_time=doc.read_time,
+                    exists=True,
+                    queries=query_names(doc),
+                ))))
+            out.write(self.encode_element(
+                BundleElement(document=doc._to_protobuf()._pb)))
+            count += 1
+            if read_time is None or doc.read_time > read_time:
+                read_time = doc.read_time
+
+        return count, read_time
+
+    def assemble_bundle(self, bundle_id: str, docs, queries: dict,
+                        query_names, out) -> dict:
+        """
+        Write a loadable Firestore bundle of docs to a binary file.
+
+        Args:
+            queries: named queries to include, by name. A name that
+                query_names gives for a doc but isn't in here is taken to
+                be a collection path, and gets a query for that collection.
+            query_names: function giving the names of the queries a doc
+                belongs to
+
+        Documents are spooled to a temp file first, since the metadata that
+        must come first needs their size.
+
+        Returns:
+            The bundle's metadata
+        """
+        queries = dict(queries)
+
+        def doc_query_names(doc):
+            names = query_names(doc)
+            for name in names:
+                if name not in queries:
+                    queries[name] = self.db.collection(name)._query()
+            return names
+
+        with SpooledTemporaryFile(max_size=self.SPOOL_MAX_BYTES) as documents:
+            document_count, read_time = self.write_documents(
+                docs, doc_query_names, documents)
+            read_time = read_time or datetime.now(timezone.utc)
+            named_queries = b''.join(
+                self.encode_element(BundleElement(
+                    named_query=self.create_named_query(
+                        name, query, read_time)))
+                for name, query in queries.items())
+            total_bytes = len(named_queries) + documents.tell()
+            metadata = self.create_bundle_metadata(
+                bundle_id, document_count, total_bytes)
+
+            out.write(self.encode_element(BundleElement(metadata=metadata)))
+            out.write(named_queries)
+            documents.seek(0)
+            shutil.copyfileobj(documents, out)
+
         return {
-            "version": 1,
-            "createTime": datetime.now(self.club_timezone).isoformat(),
-            "totalDocuments": 0,  # Will be updated later
-            "totalBytes": 0,  # Will be updated later
+            "id": bundle_id,
+            "version": self.BUNDLE_VERSION,
+            "createTime": metadata.create_time.isoformat(),
+            "totalDocuments": document_count,
+            "totalBytes": total_bytes,
         }
 
-    def _json_default(self, obj):
-        """Default handler for JSON serialization of non-standard types."""
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        elif isinstance(obj, firestore.DocumentReference):
-            return obj.path
-        raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
-
-    def encode_document(self, doc: DocumentSnapshot) -> dict:
-        """Encode a Firestore document into bundle format."""
-        fields = doc.to_dict()
-        
-        # Convert the document to a dict and serialize to JSON and back to 
-        # handle all conversions
-        doc_dict = {
-            "name": doc.reference.path,
-            "createTime": doc.create_time,
-            "updateTime": doc.update_time,
-            "fields": fields
-        }
+    def write_bundle(self, collection_path: str, out) -> dict:
+        """
+        Write a bundle of a collection to a binary file. The bundle holds one
+        named query (named after the collection path) and every document it
+        returns.
 
-        json_str = json.dumps(doc_dict, default=self._json_default)
-        return json.loads(json_str)
+        Returns:
+            The bundle's metadata
+        """
+        collection = self.db.collection(collection_path)
+        return self.assemble_bundle(
+            bundle_name(collection_path), collection.stream(),
+            {collection_path: collection._query()},
+            lambda _doc: [collection_path], out)
 
-    def generate_bundle(self, collection_path: str) -> dict:
-        """Generate a Firestore bundle from a collection path."""
-        bundle = {
-            "metadata": self.create_bundle_metadata(),
-            "namedQueries": {},
-            "documents": []
-        }
+    def year_collection_group(self) -> str:
+        """Name of every imp's trophy collection for the current year."""
+        return f"trophies{self.firebase.year}"
 
-        total_bytes = 0
-        collection_ref = self.db.collection(collection_path)
-        docs = collection_ref.stream()
-        
-        for doc in docs:
-            # encoded_doc = self.encode_document(doc)
-            bundle["documents"].append(doc)
-            total_bytes += len(str(doc).encode('utf-8'))
+    def write_year_bundle(self, out) -> dict:
+        """
+        Write one bundle with every imp's trophies for the current year to a
+        binary file, read with a single collection group query.
+
+        The bundle holds a named query for the whole year (named after the
+        collection group), and one per imp with trophies named after their
+        trophy collection's path, as in the single collection bundles.
+
+        Returns:
+            The bundle's metadata
+        """
+        group = self.year_collection_group()
+        query = self.db.collection_group(group)
+        return self.assemble_bundle(
+            group, query.stream(), {group: query},
+            lambda doc: [group, doc.reference.path.rpartition('/')[0]], out)
+
+    def stream_bundle(self, collection_path: str = None):
+        """
+        Generate a bundle for a collection, or the whole year's bundle if no
+        collection is given, yielding it in chunks of bytes. All Firestore
+        reads happen before the first chunk is yielded.
+        """
+        with SpooledTemporaryFile(max_size=self.SPOOL_MAX_BYTES) as bundle:
+            if collection_path is None:
+                self.write_year_bundle(bundle)
+            else:
+                self.write_bundle(collection_path, bundle)
+            bundle.seek(0)
+            while True:
+                chunk = bundle.read(self.CHUNK_BYTES)
+                if not chunk:
+                    return
+                yield chunk
+
+    def open_bundle(self, collection_path: str = None):
+        """
+        Get a collection's bundle, or the whole year's bundle if no
+        collection is given, from the store if there is one. Bundles that
+        aren't stored are built, and stored if there is a store.
 
-        bundle["metadata"]["totalDocuments"] = len(bundle["documents"])
-        bundle["metadata"]["totalBytes"] = total_bytes
+        Returns:
+            The bundle's StoredBundle and an iterator over its bytes, or
+            (None, None) if the collection's parent document doesn't exist.
+            Without a store, the StoredBundle only describes the bundle.
+        """
+        if collection_path is None:
+            name = bundle_name(self.year_collection_group())
+        else:
+            name = bundle_name(collection_path)
+        if self.store is not None:
+            stored = self.store.get(name)
+            if stored is not None:
+                return stored, self.store.iter_chunks(name)
+
+        if collection_path is not None:
+            # Don't build bundles for made up paths
+            parent_doc_path = collection_path.rpartition('/')[0]
+            if parent_doc_path and not self.db.document(parent_doc_path).get(
+                    field_paths=[]).exists:
+                return None, None
+
+        bundle = SpooledTemporaryFile(max_size=self.SPOOL_MAX_BYTES)
+        try:
+            if collection_path is None:
+                self.write_year_bundle(bundle)
+            else:
+                self.write_bundle(collection_path, bundle)
+            bundle.seek(0)
+            if self.store is not None:
+                stored = self.store.put(name, bundle)
+                bundle.close()
+                return stored, self.store.iter_chunks(name)
+
+            stored = StoredBundle(name=name, etag=hash_file(bundle),
+                                  size=bundle.seek(0, os.SEEK_END))
+            bundle.seek(0)
+        except BaseException:
+            bundle.close()
+            raise
+        return stored, self.iter_file_chunks(bundle)
+
+    def iter_file_chunks(self, file):
+        """Yield a binary file's contents in chunks, closing it after"""
+        with file:
+            yield from iter(lambda: file.read(self.CHUNK_BYTES), b'')
 
-        return bundle
+    def invalidate_bundles(self, collection_paths):
+        """Drop the stored bundles of collections whose documents changed,
+        along with the year bundle that includes them."""
+        if self.store is None:
+            return
+        for collection_path in collection_paths:
+            self.store.delete(bundle_name(collection_path))
+        if collection_paths:
+            self.store.delete(bundle_name(self.year_collection_group()))
+
+    def generate_bundle(self, collection_path: str) -> dict:
+        """
+        Generate a Firestore bundle from a collection path.
+
+        Returns:
+            Dictionary with the bundle's metadata and the bundle itself as
+            text, ready to be passed to a client's loadBundle
+        """
+        with io.BytesIO() as bundle:
+            metadata = self.write_bundle(collection_path, bundle)
+            return {
+                "metadata": metadata,
+                "bundle": bundle.getvalue().decode('utf-8'),
+            }
 
     def save_bundle(self, bundle_data: dict, collection_path: str):
         """
@@ -96,45 +309,143 @@ class BundleGenerator:
 
     def get_all_imp_collections(self) -> list:
         """Get all imp trophy collections for the current year."""
-        collections = []
-        imps_ref = self.db.collection('imps')
-        
-        for imp_doc in imps_ref.stream():
-            imp_name = imp_doc.id
-            collection_path = f"imps/{imp_name}/trophies{self.firebase.year}"
-            collections.append(collection_path)
-        
-        return collections
+        return [f"imps/{imp_doc.id}/trophies{self.firebase.year}"
+                for imp_doc in self.db.collection('imps').select(
+                    ['__name__']).stream()]
 
-    def generate_all_bundles(self):
+    def get_collection_versions(self) -> dict:
+        """
+        Get a version string for each of this year's imp trophy collections
+        that has any trophies, from one collection group query that reads
+        only document names and update times. The version changes whenever
+        a trophy in the collection is added, removed or edited, by anything.
+        """
+        counts = {}
+        latest = {}
+        query = self.db.collection_group(self.year_collection_group())
+        for doc in query.select(['__name__']).stream():
+            collection_path = doc.reference.path.rpartition('/')[0]
+            counts[collection_path] = counts.get(collection_path, 0) + 1
+            if collection_path not in latest \
+                    or doc.update_time > latest[collection_path]:
+                latest[collection_path] = doc.update_time
+
+        return {collection_path: f"{count}@{latest[collection_path]}"
+                for collection_path, count in counts.items()}
+
+    def generate_bundle_info(self, collection_path: str,
+                             version: str = None) -> dict:
+        """Generate a bundle and wrap it with the info reported per bundle."""
+        print(f"Generating bundle for {collection_path}")
+        bundle_data = self.generate_bundle(collection_path)
+        print(f"Generated bundle with {bundle_data['metadata']['totalDocuments']} documents")
+        name = bundle_name(collection_path)
+        bundle_bytes = bundle_data["bundle"].encode('utf-8')
+        if self.store is not None:
+            # Keep the store up to date too, so GETs don't have to rebuild it
+            self.store.put(name, io.BytesIO(bundle_bytes), version=version)
+        return {
+            "name": name,
+            "collection_path": collection_path,
+            "size": len(bundle_bytes),
+            "document_count": bundle_data["metadata"]["totalDocuments"],
+            "data": bundle_data
+        }
+
+    def stored_bundle_info(self, collection_path: str, stored) -> dict:
+        """The info reported per bundle, for a bundle read from the store."""
+        bundle_bytes = b''.join(self.store.iter_chunks(stored.name))
+        # The bundle starts with its length-prefixed metadata element
+        json_start = bundle_bytes.index(b'{')
+        metadata = json.loads(bundle_bytes[
+            json_start:json_start + int(bundle_bytes[:json_start])])['metadata']
+        document_count = int(metadata.get('totalDocuments', 0))
+        return {
+            "name": stored.name,
+            "collection_path": collection_path,
+            "size": len(bundle_bytes),
+            "document_count": document_count,
+            "data": {
+                "metadata": {
+                    "id": metadata['id'],
+                    "version": metadata.get('version', 0),
+                    "createTime": metadata.get('createTime'),
+                    "totalDocuments": document_count,
+                    "totalBytes": int(metadata.get('totalBytes', 0)),
+                },
+                "bundle": bundle_bytes.decode('utf-8'),
+            }
+        }
+
+    def generate_all_bundles(self, incremental=True):
         """
         Generate bundles for all imp trophy collections.
+
+        Args:
+            incremental: reuse any stored bundle built from the same version
+                of its collection (see get_collection_versions). Pass False
+                to regenerate everything. Without a store there is nothing
+                to reuse.
+
         Returns:
-            Dictionary with bundle data and metadata
+            Dictionary with the bundle counts, and the bundles themselves as
+            an iterator that generates them as it's consumed
         """
-        # Get all imp collections
         collections = self.get_all_imp_collections()
-        
+        versions = self.get_collection_versions() \
+            if self.store is not None else {}
+        # Collections without trophies get a version too, so their (empty)
+        # bundles can be reused as well
+        versions = {collection_path: versions.get(collection_path, "0@-")
+                    for collection_path in collections}
+
         print(f"Found {len(collections)} imp collections to process")
-        
-        generated_bundles = []
-        
-        for collection_path in collections:
-            print(f"Generating bundle for {collection_path}")
-            bundle_data = self.generate_bundle(collection_path)
-            normalized_name = collection_path.replace('/', '_')
-            bundle_info = {
-                "name": normalized_name,
-                "collection_path": collection_path,
-                "size": len(str(bundle_data).encode('utf-8')),
-                "document_count": bundle_data["metadata"]["totalDocuments"],
-                "data": bundle_data
-            }
-            
-            generated_bundles.append(bundle_info)
-            print(f"Generated bundle with {bundle_data['metadata']['totalDocuments']} documents")
+
+        reusable = {}
+        if incremental and self.store is not None:
+            for collection_path in collections:
+                stored = self.store.get(bundle_name(collection_path))
+                if stored is not None \
+                        and stored.version == versions[collection_path]:
+                    reusable[collection_path] = stored
+        stale_paths = [collection_path for collection_path in collections
+                       if collection_path not in reusable]
+
+        print(f"Regenerating {len(stale_paths)} of {len(collections)} bundles")
 
         return {
-            "total_bundles": len(generated_bundles),
-            "bundles": generated_bundles
-        } 
+            "total_bundles": len(collections),
+            "regenerated_bundles": len(stale_paths),
+            "bundles": self.iter_bundle_infos(
+                collections, stale_paths, reusable, versions)
+        }
+
+    def iter_bundle_infos(self, collections, stale_paths, reusable, versions):
+        """
+        Yield the info for each collection's bundle in order, reading
+        reusable ones from the store and generating the stale ones
+        concurrently. Only a few bundles are held at once: stale collections
+        are submitted no more than max_workers ahead of the one being yielded.
+        """
+        stale_paths = iter(stale_paths)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = deque()
+
+            def submit_next():
+                collection_path = next(stale_paths, None)
+                if collection_path is not None:
+                    pending.append(executor.submit(
+                        self.generate_bundle_info, collection_path,
+                        versions[collection_path]))
+
+            for _ in range(self.max_workers):
+                submit_next()
+
+            for collection_path in collections:
+                if collection_path in reusable:
+                    yield self.stored_bundle_info(
+                        collection_path, reusable[collection_path])
+                else:
+                    bundle_info = pending.popleft().result()
+                    submit_next()
+                    yield bundle_info
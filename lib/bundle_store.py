@@ -0,0 +1,172 @@
+"""Storage for pre-built bundles, so they can be served without reading
+Firestore until the trophies they hold change"""
+
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass
+
+from google.api_core.exceptions import NotFound
+
+from lib.helpers import atomic_write
+
+BUNDLE_MIMETYPE = 'application/x-firestore-bundle'
+BUNDLE_CHUNK_BYTES = 64 * 1024
+# How long a stored bundle is served before it's rebuilt, however it's been
+# invalidated, in case its trophies were changed by something that didn't
+# invalidate it
+BUNDLE_STORE_TTL = 60 * 60
+
+
+def bundle_name(collection_path):
+    return collection_path.replace('/', '_')
+
+
+def hash_file(file):
+    """sha256 hex digest of a binary file's contents from its current
+    position, leaving the file positioned where it started"""
+    start = file.tell()
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.read(BUNDLE_CHUNK_BYTES), b''):
+        digest.update(chunk)
+    file.seek(start)
+    return digest.hexdigest()
+
+
+@dataclass
+class StoredBundle:
+    name: str
+    # sha256 of the bundle bytes, usable as a strong ETag
+    etag: str
+    size: int
+    # Version of the Firestore data the bundle was built from, if known
+    version: str = None
+    # When the bundle was stored, in seconds since the epoch
+    created: float = None
+
+    def is_expired(self, max_age):
+        if max_age is None:
+            return False
+        return self.created is None or time.time() - self.created > max_age
+
+
+class LocalBundleStore:
+    """Stores each bundle as {directory}/{name}.bundle with a small JSON file
+    holding its hash and size alongside it. Bundles older than max_age
+    seconds read as missing."""
+
+    def __init__(self, directory, max_age=None):
+        self.directory = directory
+        self.max_age = max_age
+
+    def _base_path(self, name):
+        return os.path.join(self.directory, name)
+
+    def get(self, name):
+        try:
+            with open(self._base_path(name) + ".json", "r",
+                      encoding="utf-8") as file:
+                meta = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        stored = StoredBundle(name=name, **meta)
+        return None if stored.is_expired(self.max_age) else stored
+
+    def put(self, name, file, version=None):
+        """Store the rest of a seekable binary file as the bundle name"""
+        os.makedirs(self.directory, exist_ok=True)
+        base_path = self._base_path(name)
+        etag = hash_file(file)
+        size = 0
+        with atomic_write(base_path + ".bundle") as out:
+            for chunk in iter(lambda: file.read(BUNDLE_CHUNK_BYTES), b''):
+                out.write(chunk)
+                size += len(chunk)
+        stored = StoredBundle(name=name, etag=etag, size=size,
+                              version=version, created=time.time())
+        meta = json.dumps({"etag": etag, "size": size, "version": version,
+                           "created": stored.created}).encode("utf-8")
+        with atomic_write(base_path + ".json") as out:
+            out.write(meta)
+        return stored
+
+    def iter_chunks(self, name):
+        with open(self._base_path(name) + ".bundle", "rb") as file:
+            yield from iter(lambda: file.read(BUNDLE_CHUNK_BYTES), b'')
+
+    def delete(self, name):
+        # The metadata goes first, so the bundle reads as missing from then on
+        for extension in (".json", ".bundle"):
+            try:
+                os.remove(self._base_path(name) + extension)
+            except FileNotFoundError:
+                pass
+
+
+class CloudStorageBundleStore:
+    """Stores bundles as objects in a Cloud Storage bucket, so every app
+    instance (and the trophy scanner) shares them. Needs the
+    google-cloud-storage package and an initialized firebase app. Bundles
+    older than max_age seconds read as missing."""
+
+    def __init__(self, bucket_name, prefix="bundles/", max_age=None):
+        # Imported here so the package is only needed when this store is used
+        from firebase_admin import storage
+
+        self.bucket = storage.bucket(bucket_name)
+        self.prefix = prefix
+        self.max_age = max_age
+
+    def _blob_name(self, name):
+        return f"{self.prefix}{name}.bundle"
+
+    def get(self, name):
+        blob = self.bucket.get_blob(self._blob_name(name))
+        if blob is None or not (blob.metadata or {}).get("sha256"):
+            return None
+
+        stored = StoredBundle(name=name, etag=blob.metadata["sha256"],
+                              size=blob.size,
+                              version=blob.metadata.get("version"),
+                              created=blob.time_created.timestamp())
+        return None if stored.is_expired(self.max_age) else stored
+
+    def put(self, name, file, version=None):
+        """Store the rest of a seekable binary file as the bundle name"""
+        etag = hash_file(file)
+        blob = self.bucket.blob(self._blob_name(name))
+        blob.metadata = {"sha256": etag}
+        if version is not None:
+            blob.metadata["version"] = version
+        blob.upload_from_file(file, content_type=BUNDLE_MIMETYPE)
+        return StoredBundle(name=name, etag=etag, size=blob.size,
+                            version=version, created=time.time())
+
+    def iter_chunks(self, name):
+        with self.bucket.blob(self._blob_name(name)).open("rb") as file:
+            yield from iter(lambda: file.read(BUNDLE_CHUNK_BYTES), b'')
+
+    def delete(self, name):
+        try:
+            self.bucket.delete_blob(self._blob_name(name))
+        except NotFound:
+            pass
+
+
+def make_bundle_store():
+    """The Cloud Storage store if BUNDLE_STORE_BUCKET is set, otherwise a
+    local directory if BUNDLE_OUTPUT_DIR is set, otherwise None.
+
+    Bundles are invalidated by the trophy scanner, so the web app and the
+    scanner must share a store for invalidation to reach the app. A local
+    directory only suits running both on the same machine."""
+    max_age = int(os.environ.get('BUNDLE_STORE_TTL', BUNDLE_STORE_TTL))
+    bucket_name = os.environ.get('BUNDLE_STORE_BUCKET')
+    if bucket_name:
+        return CloudStorageBundleStore(bucket_name, max_age=max_age)
+    directory = os.environ.get('BUNDLE_OUTPUT_DIR')
+    if directory:
+        return LocalBundleStore(directory, max_age=max_age)
+    return None
@@ -2,28 +2,129 @@
 
 import configparser
 import os
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 
 import requests
 
+from lib.page_cache import PageCache
+from lib.rate_limiter import AdaptiveRateLimiter
+from lib.thread_archive import ThreadArchive
+
 
 class InvalidConfigError(Exception):
     pass
 
 
-class Dispatcher:
-    # May need to eventually refactor this into separate request handler and
-    # config handler classes.
-    SA_URL = "https://forums.somethingawful.com/"
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header, which is either a number
+    of seconds or an HTTP date. None if missing or unreadable."""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class RetryPolicy:
+    """Which failed requests to the forums are worth retrying, and how long
+    to wait before each retry. Shared by Dispatcher and AsyncDispatcher."""
+    RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+    BACKOFF_BASE_SECONDS = 1.0
+    # Longest wait before a retry, whether from backoff or Retry-After
+    MAX_BACKOFF_SECONDS = 120.0
+
+    def __init__(self, max_retries):
+        self.max_retries = max_retries
+
+    def is_retryable(self, response):
+        return response.status_code in self.RETRY_STATUS_CODES
+
+    def backoff_delay(self, attempt):
+        """Jittered exponential backoff before retry number attempt + 1"""
+        return random.uniform(0, min(
+            self.MAX_BACKOFF_SECONDS,
+            self.BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+    def retry_delay(self, attempt, response=None, error=None):
+        """Seconds to wait before retrying a request that got response, or
+        that failed with a timeout or connection error. Waits for the
+        server's Retry-After, or a jittered backoff without one.
+
+        Returns None if the request shouldn't be retried: it got a response
+        that isn't worth retrying, or attempt has used up max_retries."""
+        if response is not None and not self.is_retryable(response):
+            return None
+        if attempt >= self.max_retries:
+            return None
+
+        delay = None
+        if response is not None:
+            delay = parse_retry_after(response.headers.get("Retry-After"))
+        if delay is None:
+            delay = self.backoff_delay(attempt)
+        delay = min(delay, self.MAX_BACKOFF_SECONDS)
+
+        if response is not None:
+            print(f"Forums responded {response.status_code}, retrying "
+                  f"in {delay:.1f}s.")
+        else:
+            print(f"Request failed ({error}), retrying in {delay:.1f}s.")
+        return delay
+
+
+class DispatcherConfig:
+    """config.ini, and the settings, page cache and thread archive it sets
+    up. Shared by Dispatcher and AsyncDispatcher, which expose its config,
+    page_cache and archive to the threads reading through them."""
     CONFIG_FILE = "config.ini"
+    DEFAULT_REQUESTS_PER_SECOND = 1.0
+    DEFAULT_REQUEST_TIMEOUT = 30.0
+    DEFAULT_MAX_RETRIES = 3
+    DEFAULT_REQUEST_BURST = 1
+    DEFAULT_PAGE_CACHE_DIR = "page_cache"
+    DEFAULT_ARCHIVE_PATH = "thread_archive.sqlite3"
 
-    def __init__(self):
-        self.session = requests.Session()
+    def __init__(self, config_file=None):
+        self.config_file = config_file or self.CONFIG_FILE
         self.config = configparser.ConfigParser(interpolation=None)
-        if not os.path.isfile(self.CONFIG_FILE):
-            raise InvalidConfigError(f"{self.CONFIG_FILE} is missing!")
-        self.config.read(self.CONFIG_FILE)
-        self.logged_in = False
-        self.default_thread = self.config["DEFAULT"]["izgc_thread_id"]
+        if not os.path.isfile(self.config_file):
+            raise InvalidConfigError(f"{self.config_file} is missing!")
+        self.config.read(self.config_file)
+        defaults = self.config["DEFAULT"]
+        self.default_thread = defaults["izgc_thread_id"]
+        # Requests start at requests_per_second and speed up towards
+        # max_requests_per_second while the forums keep up. Without a max,
+        # the rate never goes above requests_per_second.
+        self.requests_per_second = defaults.getfloat(
+            "requests_per_second", fallback=self.DEFAULT_REQUESTS_PER_SECOND)
+        self.max_requests_per_second = defaults.getfloat(
+            "max_requests_per_second", fallback=self.requests_per_second)
+        self.request_timeout = defaults.getfloat(
+            "request_timeout", fallback=self.DEFAULT_REQUEST_TIMEOUT)
+        self.max_retries = defaults.getint(
+            "max_retries", fallback=self.DEFAULT_MAX_RETRIES)
+        self.request_burst = defaults.getint(
+            "request_burst", fallback=self.DEFAULT_REQUEST_BURST)
+        # Leave page_cache_dir blank in config to always fetch from forums
+        page_cache_dir = defaults.get(
+            "page_cache_dir", self.DEFAULT_PAGE_CACHE_DIR)
+        self.page_cache = PageCache(page_cache_dir) if page_cache_dir else None
+        # Every page parsed is also saved here; leave archive_path blank in
+        # config to turn this off
+        archive_path = defaults.get(
+            "archive_path", self.DEFAULT_ARCHIVE_PATH)
+        self.archive = ThreadArchive(archive_path) if archive_path else None
 
     def check_sa_creds(self):
         if "username" not in self.config["DEFAULT"] \
@@ -31,12 +132,12 @@ class Dispatcher:
                 or self.config["DEFAULT"]["username"] == "" \
                 or self.config["DEFAULT"]["password"] == "":
             raise InvalidConfigError(
-                f"username and password not present in {self.CONFIG_FILE}.")
-
-    def login(self, required=True):
-        if self.logged_in:
-            return
+                f"username and password not present in {self.config_file}.")
 
+    def login_form(self, required=True):
+        """The form to post to account.php to log in, or None to carry on
+        as an anonymous user if there are no credentials and login isn't
+        required"""
         try:
             self.check_sa_creds()
         except InvalidConfigError:
@@ -47,19 +148,81 @@ class Dispatcher:
                 "Warning! Cannot proceed with login, continuing as " +
                 "anonymous user."
             )
-            return
+            return None
 
-        info = {"username": self.config["DEFAULT"]["username"],
+        return {"username": self.config["DEFAULT"]["username"],
                 "password": self.config["DEFAULT"]["password"],
                 "action": "login"
                 }
+
+    def save(self):
+        with open(self.config_file, "w", encoding="utf-8") as file:
+            self.config.write(file)
+
+
+class Dispatcher:
+    SA_URL = "https://forums.somethingawful.com/"
+    CONFIG_FILE = DispatcherConfig.CONFIG_FILE
+
+    def __init__(self, settings=None):
+        self.session = requests.Session()
+        self.settings = settings or DispatcherConfig(self.CONFIG_FILE)
+        self.config = self.settings.config
+        self.page_cache = self.settings.page_cache
+        self.archive = self.settings.archive
+        self.default_thread = self.settings.default_thread
+        self.logged_in = False
+        # Shared by every thread making requests through this dispatcher, so
+        # concurrent page fetches still add up to a polite request rate.
+        self.rate_limiter = AdaptiveRateLimiter(
+            self.settings.requests_per_second,
+            max_rate=self.settings.max_requests_per_second)
+        self.request_timeout = self.settings.request_timeout
+        self.retry_policy = RetryPolicy(self.settings.max_retries)
+
+    def check_sa_creds(self):
+        self.settings.check_sa_creds()
+
+    def login(self, required=True):
+        if self.logged_in:
+            return
+
+        info = self.settings.login_form(required)
+        if info is None:
+            return
+
         self.session.post(
-            f"{self.SA_URL}account.php", data=info)
+            f"{self.SA_URL}account.php", data=info,
+            timeout=self.request_timeout)
         self.logged_in = True
 
     def get_thread(self, **kwargs):
-        return self.session.get(f"{self.SA_URL}showthread.php", **kwargs)
+        """GET showthread.php, retrying timeouts, connection errors, 429s and
+        5xx responses as the retry policy allows. While a retry waits, every
+        other request through this dispatcher waits too. The last error
+        response is returned if retries run out."""
+        kwargs.setdefault("timeout", self.request_timeout)
+        attempt = 0
+        while True:
+            self.rate_limiter.wait()
+            started = time.monotonic()
+            try:
+                response = self.session.get(
+                    f"{self.SA_URL}showthread.php", **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                delay = self.retry_policy.retry_delay(attempt, error=error)
+                if delay is None:
+                    raise
+            else:
+                delay = self.retry_policy.retry_delay(attempt, response)
+                if delay is None:
+                    if not self.retry_policy.is_retryable(response):
+                        self.rate_limiter.record_response(
+                            time.monotonic() - started)
+                    return response
+
+            self.rate_limiter.back_off(delay)
+            attempt += 1
 
     def save_config(self):
-        with open(self.CONFIG_FILE, "w", encoding="utf-8") as file:
-            self.config.write(file)
+        self.settings.save()
@@ -1,14 +1,28 @@
 from datetime import datetime
+import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import pytz
 import firebase_admin
 from firebase_admin import firestore
 from firebase_admin import credentials
+from google.api_core.exceptions import GoogleAPICallError
+from google.api_core.retry import if_transient_error
 from google.cloud.firestore_v1.base_query import FieldFilter
 
+from lib.trophy_catalog import TrophyCatalogSnapshot
+
 CLUB_TIMEZONE = pytz.timezone('US/Eastern')
+# Where generated files, like the trophy catalog snapshot, go by default
+DATA_DIR = os.environ.get('IMP_DATA_DIR') or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+# Touched by anything that edits the trophy catalog, so that edits which
+# don't change how many games, events or trophies there are still show up
+# in the catalog's change token
+CATALOG_MARKER_PATH = 'meta/trophyCatalog'
 
 
 class DbWarning(Warning):
@@ -27,6 +41,14 @@ def new_year_datetime(year):
 
 
 class FirebaseHandler:
+    # Firestore rejects batches with more than 500 writes
+    MAX_BATCH_WRITES = 500
+    BATCH_ATTEMPTS = 3
+    # Firestore limits how many values an "in" filter may compare against
+    MAX_IN_QUERY_VALUES = 10
+    # Seconds a local trophy catalog snapshot is trusted for
+    CATALOG_MAX_AGE = 24 * 60 * 60
+
     def __init__(self, year=None):
         # Check if Firebase is already initialized
         if not firebase_admin._apps:
@@ -84,15 +106,68 @@ class FirebaseHandler:
         self.year = year or datetime.now().astimezone(CLUB_TIMEZONE).year
         self.all_trophies_event_windows = []
         self._eligible_trophies = None
+        # Optional JSON file remembering which imp document each forum
+        # username resolved to on previous runs
+        self.imp_cache_path = os.environ.get('IMP_CACHE_FILE')
+        self._imp_refs = self.load_imp_cache()
+        # Set TROPHY_CATALOG_FILE to an empty string to always rebuild the
+        # catalog from the db
+        catalog_path = os.environ.get(
+            'TROPHY_CATALOG_FILE',
+            os.path.join(DATA_DIR, 'trophy_catalog.json'))
+        self.catalog_snapshot = TrophyCatalogSnapshot(
+            catalog_path, max_age=int(os.environ.get(
+                'TROPHY_CATALOG_MAX_AGE', self.CATALOG_MAX_AGE))) \
+            if catalog_path else None
 
     @property
     def eligible_trophies(self):
         if self._eligible_trophies is None:
-            self._eligible_trophies = self.get_trophy_dict_from_db()
+            self._eligible_trophies = self.load_trophy_catalog()
 
         return self._eligible_trophies
 
-    def get_time_window(self, game_or_event_doc):
+    def get_catalog_change_token(self):
+        """A string that changes whenever a game, event or trophy is added or
+        removed, or the catalog marker doc is touched. Costs one count
+        aggregation per collection and one document read, however big the
+        catalog is."""
+        queries = [
+            self.db_client.collection('games'),
+            self.db_client.collection('events'),
+            self.db_client.collection_group('trophies'),
+        ]
+        with ThreadPoolExecutor(max_workers=len(queries) + 1) as executor:
+            counts = executor.map(
+                lambda query: query.count().get()[0][0].value, queries)
+            marker = executor.submit(
+                self.db_client.document(CATALOG_MARKER_PATH).get)
+            parts = [str(count) for count in counts]
+            update_time = marker.result().update_time
+            parts.append(update_time.isoformat() if update_time else '-')
+
+        return '|'.join(parts)
+
+    def load_trophy_catalog(self):
+        if self.catalog_snapshot is None:
+            return self.get_trophy_dict_from_db()
+
+        change_token = self.get_catalog_change_token()
+        snapshot = self.catalog_snapshot.load(
+            self.year, change_token, self.db_client.document)
+        if snapshot is not None:
+            print('Trophy catalog unchanged, using local snapshot.')
+            trophy_dict, self.all_trophies_event_windows = snapshot
+            return trophy_dict
+
+        trophy_dict = self.get_trophy_dict_from_db()
+        self.catalog_snapshot.save(self.year, change_token, trophy_dict,
+                                   self.all_trophies_event_windows)
+        return trophy_dict
+
+    def get_time_window(self, game_or_event_doc, umbrella_events=None):
+        """umbrella_events optionally maps event paths to already-fetched
+        event snapshots, to avoid fetching each umbrella event separately."""
         properties = game_or_event_doc.to_dict()
         default_start_time = new_year_datetime(self.year)
         default_end_time = new_year_datetime(self.year + 1)
@@ -115,44 +190,107 @@ class FirebaseHandler:
                   'time window will be applied for its trophies.')
             return default_start_time, default_end_time
 
-        event_doc = properties['event'].get()
-        event = event_doc.to_dict()
+        event_ref = properties['event']
+        event_doc = (umbrella_events or {}).get(event_ref.path)
+        if event_doc is None:
+            event_doc = event_ref.get()
+        event = event_doc.to_dict() or {}
         if event.get('startTime') and event.get('endTime'):
             start_time = event['startTime']
             end_time = event['endTime']
             return start_time, end_time
 
         print(f'*** Warning! {game_or_event_doc.id} is associated ' +
-              f'with event {event.id}, which does not have a start ' +
+              f'with event {event_doc.id}, which does not have a start ' +
               'and/or end time. No time window will be applied for ' +
               'its trophies.')
         return default_start_time, default_end_time
 
-    def get_firebase_trophies_by_collection_type(
-            self, collection_name, year_property):
-        trophy_dict = {}
+    def has_catalog_year(self, year):
+        """Whether any game or event in the catalog is for the given year.
+        Reads at most one document per collection."""
+        for collection, year_property in (('games', 'clubYear'),
+                                          ('events', 'year')):
+            query = self.db_client.collection(collection).where(
+                filter=FieldFilter(year_property, '==', year)).limit(1)
+            if any(True for _doc in query.select(['__name__']).stream()):
+                return True
+
+        return False
+
+    def is_trophy_source_this_year(self, doc, year_property):
+        properties = doc.to_dict()
+        # don't scan for trophies from hidden games/events
+        if properties.get('hidden'):
+            return False
+
+        # only gather trophies from games/events from this year
+        doc_year = properties.get(year_property)
+        if not doc_year:
+            print(f'*** Warning! No year entered for {doc.id}. Trophies ' +
+                  'will never be gathered.')
+            return False
 
-        doc_stream = self.db_client.collection(collection_name).stream()
-        for doc in doc_stream:
-            properties = doc.to_dict()
-            # don't scan for trophies from hidden games/events
-            if properties.get('hidden'):
-                continue
-
-            # only gather trophies from games/events from this year
-            doc_year = properties.get(year_property)
-            if not doc_year:
-                print(f'*** Warning! No year entered for {doc.id}. Trophies ' +
-                      'will never be gathered.')
-                continue
-            if doc_year != self.year:
-                continue
-
-            start_time, end_time = self.get_time_window(doc)
-
-            path = doc.reference.path
-            trophy_docs = self.db_client.collection(path + '/trophies')
-            for trophy_doc in trophy_docs.stream():
+        return doc_year == self.year
+
+    def get_umbrella_events(self, docs, known_events):
+        """Fetch, in one batched read, any umbrella events referenced by docs
+        that aren't already in known_events (a path -> snapshot dict)."""
+        missing = {}
+        for doc in docs:
+            event_ref = doc.to_dict().get('event')
+            if event_ref is not None and event_ref.path not in known_events:
+                missing[event_ref.path] = event_ref
+
+        umbrella_events = dict(known_events)
+        if missing:
+            for event_doc in self.db_client.get_all(list(missing.values())):
+                umbrella_events[event_doc.reference.path] = event_doc
+
+        return umbrella_events
+
+    def get_trophy_dict_from_db(self):
+        """Load the trophy catalog in a handful of concurrent reads: the games
+        collection, the events collection, and every trophy at once through a
+        collection group query. Umbrella events are then read in one batch."""
+        print('Retrieving eligible trophies from db...')
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            games = executor.submit(
+                lambda: list(self.db_client.collection('games').stream()))
+            events = executor.submit(
+                lambda: list(self.db_client.collection('events').stream()))
+            trophies = executor.submit(lambda: list(
+                self.db_client.collection_group('trophies').stream()))
+
+            sources = [
+                doc for doc in games.result()
+                if self.is_trophy_source_this_year(doc, 'clubYear')
+            ] + [
+                doc for doc in events.result()
+                if self.is_trophy_source_this_year(doc, 'year')
+            ]
+            umbrella_events = self.get_umbrella_events(
+                sources,
+                {doc.reference.path: doc for doc in events.result()})
+
+            time_windows = {
+                doc.reference.path: self.get_time_window(doc, umbrella_events)
+                for doc in sources
+            }
+
+            trophies_by_source = {}
+            for trophy_doc in trophies.result():
+                source_path = trophy_doc.reference.parent.parent.path \
+                    if trophy_doc.reference.parent.parent else None
+                trophies_by_source.setdefault(source_path, []).append(
+                    trophy_doc)
+
+        trophy_dict = {}
+        # Events are listed after games so that, as before, an event's trophy
+        # wins if a game and an event use the same image
+        for doc in sources:
+            start_time, end_time = time_windows[doc.reference.path]
+            for trophy_doc in trophies_by_source.get(doc.reference.path, []):
                 trophy_data = {
                     "game": doc.id,
                     "name": trophy_doc.id,
@@ -165,17 +303,83 @@ class FirebaseHandler:
 
         return trophy_dict
 
-    def get_trophy_dict_from_db(self):
-        print('Retrieving eligible trophies from db...')
-        game_trophies = self.get_firebase_trophies_by_collection_type(
-            'games', 'clubYear')
-        event_trophies = self.get_firebase_trophies_by_collection_type(
-            'events', 'year')
-        trophy_dict = game_trophies | event_trophies
+    def load_imp_cache(self):
+        if not self.imp_cache_path:
+            return {}
 
-        return trophy_dict
+        try:
+            with open(self.imp_cache_path, 'r', encoding='utf-8') as file:
+                paths = json.load(file)
+        except FileNotFoundError:
+            return {}
+
+        return {username: self.db_client.document(path)
+                for username, path in paths.items()}
+
+    def save_imp_cache(self):
+        if not self.imp_cache_path:
+            return
+
+        with open(self.imp_cache_path, 'w', encoding='utf-8') as file:
+            json.dump({username: imp_ref.path
+                       for username, imp_ref in self._imp_refs.items()},
+                      file, indent=2)
+
+    def prefetch_imps(self, usernames=None):
+        """Resolve many usernames to imp documents up front, so that
+        get_imp_by_username doesn't need any round trips for them.
+
+        With no usernames, the whole imps collection is read in a single
+        stream. Otherwise, the documents named after the usernames are fetched
+        in one batched read, and the rest are looked up by currentUsername in
+        a handful of "in" queries. Usernames that match no imp or more than
+        one are left for get_imp_by_username to warn or fail on.
+        """
+        if usernames is None:
+            by_username = {}
+            for doc in self.db_client.collection('imps').select(
+                    ['currentUsername']).stream():
+                self._imp_refs[doc.id] = doc.reference
+                current_username = doc.to_dict().get('currentUsername')
+                if current_username:
+                    by_username.setdefault(current_username, []).append(
+                        doc.reference)
+            for username, imp_refs in by_username.items():
+                if username not in self._imp_refs and len(imp_refs) == 1:
+                    self._imp_refs[username] = imp_refs[0]
+            return
+
+        unresolved = {username for username in usernames
+                      if username not in self._imp_refs}
+        if not unresolved:
+            return
+
+        imp_docs = self.db_client.get_all(
+            [self.db_client.document(f'imps/{username}')
+             for username in unresolved],
+            field_paths=[])
+        for imp_doc in imp_docs:
+            if imp_doc.exists:
+                self._imp_refs[imp_doc.id] = imp_doc.reference
+                unresolved.discard(imp_doc.id)
+
+        unresolved = sorted(unresolved)
+        by_username = {}
+        for start in range(0, len(unresolved), self.MAX_IN_QUERY_VALUES):
+            query = self.db_client.collection('imps').where(filter=FieldFilter(
+                "currentUsername", "in",
+                unresolved[start:start + self.MAX_IN_QUERY_VALUES]))
+            for doc in query.stream():
+                by_username.setdefault(doc.get('currentUsername'), []).append(
+                    doc.reference)
+        for username, imp_refs in by_username.items():
+            if len(imp_refs) == 1:
+                self._imp_refs[username] = imp_refs[0]
 
     def get_imp_by_username(self, imp):
+        if imp in self._imp_refs:
+            return self._imp_refs[imp]
+
         imp_ref = self.db_client.document(f'imps/{imp}')
         imp_doc = imp_ref.get()
         if not imp_doc.exists:
@@ -195,18 +399,76 @@ class FirebaseHandler:
             else:
                 imp_ref = imps_with_name[0].reference
 
+        self._imp_refs[imp] = imp_ref
         return imp_ref
 
-    def write_trophies_to_db(self, imp, trophies):
+    def get_trophy_writes(self, imp, trophies):
         imp_ref = self.get_imp_by_username(imp)
+        writes = []
         for game, trophy in trophies.items():
             for trophy_name, trophy_data in trophy.items():
                 trophy_ref = self.db_client.document(
                     imp_ref.path +
                     f'/trophies{self.year}/[{game}] {trophy_name}'
                 )
-                trophy_ref.set({
+                writes.append((trophy_ref, {
                     'trophy': trophy_data['reference'],
                     'postUrl': trophy_data['link'],
                     'timestamp': trophy_data['timestamp'],
-                })
+                }))
+
+        return writes
+
+    def commit_batch(self, writes):
+        # A batch commits atomically, so on failure the whole batch is
+        # retried. Only errors that could go away on their own (unavailable,
+        # deadline exceeded etc.) are worth retrying.
+        for attempt in range(1, self.BATCH_ATTEMPTS + 1):
+            batch = self.db_client.batch()
+            for trophy_ref, data in writes:
+                batch.set(trophy_ref, data)
+            try:
+                batch.commit()
+                return True
+            except GoogleAPICallError as exc:
+                if not if_transient_error(exc):
+                    print(f'*** Warning! Batch of {len(writes)} writes ' +
+                          f'failed: {exc}')
+                    return False
+                print(f'*** Warning! Batch of {len(writes)} writes failed ' +
+                      f'(attempt {attempt} of {self.BATCH_ATTEMPTS}): {exc}')
+                if attempt < self.BATCH_ATTEMPTS:
+                    time.sleep(2 ** attempt)
+
+        return False
+
+    def write_all_trophies_to_db(self, imp_trophies):
+        """Write trophies for every imp in as few batched commits as possible.
+
+        Returns a summary dict with the number of trophies committed, the
+        trophy collections of the imps whose writes were committed and the
+        document paths of any trophies that failed to save.
+        """
+        self.prefetch_imps(imp_trophies.keys())
+        writes = []
+        for imp, trophies in imp_trophies.items():
+            writes += self.get_trophy_writes(imp, trophies)
+        self.save_imp_cache()
+
+        summary = {'committed': 0, 'failed': [], 'collections': []}
+        for start in range(0, len(writes), self.MAX_BATCH_WRITES):
+            chunk = writes[start:start + self.MAX_BATCH_WRITES]
+            if self.commit_batch(chunk):
+                summary['committed'] += len(chunk)
+                for trophy_ref, _data in chunk:
+                    collection_path = trophy_ref.path.rpartition('/')[0]
+                    if collection_path not in summary['collections']:
+                        summary['collections'].append(collection_path)
+            else:
+                summary['failed'] += [
+                    trophy_ref.path for trophy_ref, _data in chunk]
+
+        return summary
+
+    def write_trophies_to_db(self, imp, trophies):
+        return self.write_all_trophies_to_db({imp: trophies})
@@ -0,0 +1,89 @@
+"""Constant time weighted random selection of flags"""
+
+import random
+from collections import Counter
+
+
+class AliasTable:
+    """Walker's alias method: built in O(n) from a list of positive weights,
+    after which each sample takes two random numbers and no allocation."""
+
+    def __init__(self, weights):
+        count = len(weights)
+        total = sum(weights)
+        if count == 0 or total <= 0:
+            raise ValueError("Alias table needs at least one positive weight")
+
+        # Scale so the average weight is 1, then pair each column that's
+        # short of 1 with one that has weight to spare
+        scaled = [weight * count / total for weight in weights]
+        self.probability = [1.0] * count
+        self.alias = list(range(count))
+        small = [i for i, weight in enumerate(scaled) if weight < 1]
+        large = [i for i, weight in enumerate(scaled) if weight >= 1]
+        while small and large:
+            short, spare = small.pop(), large.pop()
+            self.probability[short] = scaled[short]
+            self.alias[short] = spare
+            scaled[spare] += scaled[short] - 1
+            (small if scaled[spare] < 1 else large).append(spare)
+        # Anything left over is only short of 1 by rounding error, so keeps
+        # a probability of 1
+
+        self.count = count
+
+    def sample(self, rand=random.random):
+        """Returns an index chosen with probability proportional to its
+        weight."""
+        column = int(rand() * self.count)
+        if rand() < self.probability[column]:
+            return column
+        return self.alias[column]
+
+
+class FlagSelector:
+    """Picks random flags from a fixed set of flags. Build a new one when the
+    flags change.
+
+    Disabled flags and flags weighted 0 are never picked. With
+    creator_fairness, each creator is equally likely to be picked no matter
+    how many flags they made. Flags served within the last recent_window
+    picks are redrawn, a few times at most, so repeats are rare.
+    """
+    # Redraws allowed per pick when the drawn flag was recently served
+    MAX_REDRAWS = 8
+
+    def __init__(self, flags, creator_fairness=False, recent_window=0):
+        self.flags = tuple(
+            flag for flag in flags if not flag.disabled and flag.weight > 0)
+        if not self.flags:
+            raise ValueError("No flag images available")
+
+        flags_by_creator = Counter(flag.by for flag in self.flags)
+        self.table = AliasTable([
+            flag.weight / flags_by_creator[flag.by] if creator_fairness
+            else flag.weight
+            for flag in self.flags
+        ])
+
+        # Suppressing more than half the flags would make most draws redraws
+        self.recent_window = min(recent_window, len(self.flags) // 2)
+        self._served = 0
+        self._last_served = [-self.recent_window - 1] * len(self.flags)
+
+    def choose(self):
+        return self.flags[self.choose_index()]
+
+    def choose_index(self):
+        """Returns the index in self.flags of a randomly picked flag."""
+        index = self.table.sample()
+        for _ in range(self.MAX_REDRAWS):
+            if self._served - self._last_served[index] > self.recent_window:
+                break
+            index = self.table.sample()
+
+        # Requests are served on several threads, so these can race. That
+        # only ever lets a recent flag through early, which is harmless.
+        self._last_served[index] = self._served
+        self._served += 1
+        return index
@@ -1,15 +1,16 @@
-import random
 import json
 import logging
 import os
 import requests
-from typing import List
+from typing import List, Tuple
 from dataclasses import dataclass
 from urllib.parse import quote
 
 from bs4 import BeautifulSoup
 from PIL import Image
 
+from lib.flag_selector import FlagSelector
+
 logger = logging.getLogger(__name__)
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -26,19 +27,53 @@ class FlagLoadError(Exception):
 class Flag:
     name: str
     by: str
+    # Relative chance of being picked at random
+    weight: float = 1.0
+    disabled: bool = False
 
 class FlagHandler:
     def __init__(self):
         """
         Initialize the FlagHandler with a list of flag images.
         """
+        # Give every creator the same chance of being picked, rather than
+        # every flag
+        self.creator_fairness = os.environ.get(
+            'FLAG_CREATOR_FAIRNESS', '').lower() in ('1', 'true', 'yes')
+        # Avoid repeating any of the last few flags served
+        self.recent_window = int(os.environ.get('FLAG_RECENT_WINDOW', 0))
+        # The flag selector, along with each selectable flag's redirect URL
+        # without and with its creator, or None if there are no flags
+        self._selection = None
         self._load_flags_from_file()
 
     @property
-    def flags(self) -> List[Flag]:
-        """Get the current list of flag images."""
-        return self._flags.copy()  # Return a copy to prevent direct modification
-    
+    def flags(self) -> Tuple[Flag, ...]:
+        """Get the current flag images."""
+        return self._flags  # A tuple, so it can't be modified directly
+
+    def _set_flags(self, flags: List[Flag]) -> None:
+        """
+        Replace the flag list, and rebuild the random flag selector and the
+        flags' redirect URLs, so picking a random flag URL is just a lookup.
+        """
+        self._flags = tuple(flags)
+        try:
+            selector = FlagSelector(
+                self._flags, self.creator_fairness, self.recent_window)
+        except ValueError:
+            # No flags to pick from; get_random_flag will complain
+            self._selection = None
+            return
+
+        redirect_urls = tuple(
+            (self.generate_flag_url(flag),
+             self.generate_flag_url(flag, with_creator_metadata=True))
+            for flag in selector.flags)
+        # Swapped in as one object, so requests never see a selector and
+        # URLs that don't belong together
+        self._selection = (selector, redirect_urls)
+
     def get_random_flag(self) -> Flag:
         """
         Return a random flag from the list.
@@ -46,21 +81,26 @@ class FlagHandler:
         Returns:
             Dict in format { flag_url, flag_creator)
         """
-        if not self._flags:
+        selection = self._selection
+        if selection is None:
             raise ValueError("No flag images available")
 
-        flag = random.choice(self._flags)
-        logger.info(f"Selected flag: {flag}")
+        flag = selection[0].choose()
+        logger.debug("Selected flag: %s", flag)
 
         return flag
     
-    def generate_flag_url(self, flag) -> str:
+    def generate_flag_url(self, flag, with_creator_metadata=False) -> str:
         """Generate a flag url for the supplied flag based on name."""
         SA_URL = 'https://fi.somethingawful.com/images/impzone/flags/'
         url = SA_URL + flag.name
         # Encode the URL to handle spaces and special characters
         encoded_url = quote(url, safe=':/?=&#')
 
+        if with_creator_metadata:
+            encoded_creator = quote(flag.by, safe=':/?=&#')
+            encoded_url += f'?by={encoded_creator}'
+
         return encoded_url
 
     def get_random_flag_url(self, with_creator_metadata=False) -> str:
@@ -74,14 +114,13 @@ class FlagHandler:
         Returns:
             URL of a random flag.
         """
-        flag = self.get_random_flag()
-        url = self.generate_flag_url(flag)
-
-        if with_creator_metadata:
-            encoded_creator = quote(flag.by, safe=':/?=&#')
-            url += f'?by={encoded_creator}'
+        selection = self._selection
+        if selection is None:
+            raise ValueError("No flag images available")
 
-        return url
+        selector, redirect_urls = selection
+        urls = redirect_urls[selector.choose_index()]
+        return urls[1] if with_creator_metadata else urls[0]
     
     def get_flag_list_from_html(self) -> List[Flag]:
         """
@@ -107,9 +146,9 @@ class FlagHandler:
         Args: 
             new_flags (List[Flag]): List of flags to add to existing list
         """
-        combined_flags = self.flags + new_flags
+        combined_flags = list(self.flags) + new_flags
         sorted_flags = self.sort_flags_by_name(combined_flags)
-        self._flags = sorted_flags
+        self._set_flags(sorted_flags)
 
         logger.info(f'Saving combined list of {len(self._flags)} to file.')
         self._save_to_file()
@@ -177,7 +216,7 @@ class FlagHandler:
         try:
             with open(FLAGS_JSON_PATH, 'r') as file:
                 data = json.load(file)
-                self._flags = [Flag(**flag_data) for flag_data in data.get('flags', [])]
+                self._set_flags([Flag(**flag_data) for flag_data in data.get('flags', [])])
         except FileNotFoundError:
             message = f"{FLAGS_JSON_PATH} file not found"
             logger.error(message)
@@ -252,14 +291,22 @@ class FlagHandler:
         
         return Flag(name=flag_name, by=creator)
 
+    def _flag_to_json(self, flag: Flag) -> dict:
+        """Flag data to save, leaving out fields that have default values."""
+        data = {'name': flag.name, 'by': flag.by}
+        if flag.weight != 1.0:
+            data['weight'] = flag.weight
+        if flag.disabled:
+            data['disabled'] = True
+        return data
+
     def _save_to_file(self) -> None:
         """Save the current list of flag images to the JSON file."""
         try:
             with open(FLAGS_JSON_PATH, 'w') as file:
                 json.dump({
                     'flags': [
-                        {'name': flag.name, 'by': flag.by}
-                        for flag in self._flags
+                        self._flag_to_json(flag) for flag in self._flags
                     ]
                 }, file, indent=4)
         except Exception as e:
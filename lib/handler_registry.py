@@ -0,0 +1,62 @@
+"""Long-lived db handlers shared across web app requests"""
+
+import logging
+import threading
+from datetime import datetime
+
+from lib.bundle_generator import BundleGenerator
+from lib.firebase_handler import FirebaseHandler, CLUB_TIMEZONE
+
+logger = logging.getLogger(__name__)
+
+
+class HandlerRegistry:
+    """Hands out one FirebaseHandler/BundleGenerator pair per club year, so
+    requests reuse the same Firestore client (and its gRPC channel) instead
+    of repeating credential discovery and client setup every time."""
+
+    def __init__(self):
+        self._bundle_generators = {}
+        # Years known to have games or events in the catalog
+        self._catalog_years = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize_year(year=None):
+        if year is None:
+            return datetime.now().astimezone(CLUB_TIMEZONE).year
+        return int(year)
+
+    def get_bundle_generator(self, year=None) -> BundleGenerator:
+        year = self.normalize_year(year)
+        with self._lock:
+            if year not in self._bundle_generators:
+                logger.info(f"Creating db handlers for {year}")
+                self._bundle_generators[year] = BundleGenerator(
+                    FirebaseHandler(year=year))
+            return self._bundle_generators[year]
+
+    def is_catalog_year(self, year) -> bool:
+        """Whether a year has any games or events in the catalog, checked
+        with the current year's handler so unknown years never get handlers
+        of their own. Only known years are remembered, so a newly added year
+        is picked up on the next check."""
+        year = self.normalize_year(year)
+        if year in self._catalog_years:
+            return True
+        if self.get_firebase_handler().has_catalog_year(year):
+            self._catalog_years.add(year)
+            return True
+        return False
+
+    def get_firebase_handler(self, year=None) -> FirebaseHandler:
+        return self.get_bundle_generator(year).firebase
+
+    def warm_up(self, year=None):
+        """Create the handlers for a year ahead of the first request. Errors
+        are logged rather than raised so the app can still start and serve
+        routes that don't need the db."""
+        try:
+            self.get_bundle_generator(year)
+        except Exception as e:
+            logger.error(f"Could not warm up db handlers: {str(e)}")
@@ -1,3 +1,7 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
 import pytz
 
 
@@ -16,3 +20,19 @@ def datetime_formatted_est(datetime):
     est = pytz.timezone('US/Eastern')
     as_est = datetime.astimezone(est).strftime("%b %d, %Y %H:%M") + ' EST'
     return as_est
+
+
+@contextmanager
+def atomic_write(path, mode="wb", **kwargs):
+    """Open a temporary file beside path for writing, and move it over path
+    once the block completes. Files that other threads or processes may be
+    reading are only ever seen whole, as the old version or the new one."""
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, mode, **kwargs) as file:
+            yield file
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
@@ -0,0 +1,79 @@
+"""Persistent on-disk cache of raw thread pages"""
+
+import gzip
+import json
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from lib.helpers import atomic_write
+
+
+@dataclass
+class CachedPage:
+    html: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    # Full pages can never change again, so they are served without asking
+    # the forums. Partial pages must be revalidated.
+    complete: bool = False
+
+    def revalidation_headers(self):
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class PageCache:
+    """Stores gzipped page HTML under
+    {directory}/{viewer}/{thread}/{perpage}/{page}.html.gz with a small JSON
+    file of validators alongside it.
+
+    Pages are cached per viewer because logged-in and anonymous users are
+    served different markup (word filters, read markers).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _base_path(self, key):
+        viewer, thread_id, page_number, perpage = key
+        return os.path.join(self.directory, str(viewer), str(thread_id),
+                            str(perpage), str(page_number))
+
+    def get(self, key):
+        base_path = self._base_path(key)
+        try:
+            with open(base_path + ".json", "r", encoding="utf-8") as file:
+                meta = json.load(file)
+            with gzip.open(base_path + ".html.gz", "rt",
+                           encoding="utf-8") as file:
+                html = file.read()
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+
+        return CachedPage(html=html, **meta)
+
+    def put(self, key, page):
+        base_path = self._base_path(key)
+        os.makedirs(os.path.dirname(base_path), exist_ok=True)
+        with atomic_write(base_path + ".html.gz") as file:
+            file.write(gzip.compress(page.html.encode("utf-8")))
+        self._write_meta(base_path, page)
+
+    def mark_complete(self, key):
+        page = self.get(key)
+        if page is None or page.complete:
+            return
+
+        page.complete = True
+        self._write_meta(self._base_path(key), page)
+
+    def _write_meta(self, base_path, page):
+        meta = {"etag": page.etag, "last_modified": page.last_modified,
+                "complete": page.complete}
+        with atomic_write(base_path + ".json") as file:
+            file.write(json.dumps(meta).encode("utf-8"))
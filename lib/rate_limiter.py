@@ -0,0 +1,147 @@
+"""Thread-safe throttling for requests made to the forums"""
+
+import asyncio
+import threading
+import time
+
+
+class RateLimiter:
+    """Spaces out callers so that at most `rate` requests start per second,
+    no matter how many threads are making them."""
+
+    def __init__(self, rate):
+        if rate <= 0:
+            raise ValueError("rate must be a positive number of requests.")
+        self.interval = 1 / rate
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        # Reserve the next free slot while holding the lock, but do the
+        # actual sleeping outside of it so other threads can queue up behind.
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class AdaptiveRate:
+    """Mixin for limiters that look for the fastest rate the server
+    tolerates.
+
+    Starting from `rate`, each quick response nudges the rate up by `step`,
+    to at most `max_rate` (by default, `rate` itself, so nothing speeds up
+    unless asked to). Slow responses and back-offs halve it, to no less than
+    `min_rate`.
+    """
+    SLOW_RESPONSE_SECONDS = 2.0
+
+    def init_adaptive_rate(self, rate, max_rate=None, min_rate=None,
+                           step=None):
+        self.max_rate = rate if max_rate is None else max(rate, max_rate)
+        self.min_rate = rate / 8 if min_rate is None else min(rate, min_rate)
+        self.step = self.max_rate / 20 if step is None else step
+        self.rate = rate
+
+    def _set_rate(self, rate):
+        self.rate = min(self.max_rate, max(self.min_rate, rate))
+
+    def adjust_for_response(self, latency):
+        if latency > self.SLOW_RESPONSE_SECONDS:
+            self._set_rate(self.rate / 2)
+        else:
+            self._set_rate(self.rate + self.step)
+
+
+class AdaptiveRateLimiter(AdaptiveRate, RateLimiter):
+    """A RateLimiter whose rate adapts to the server; see AdaptiveRate."""
+
+    def __init__(self, rate, max_rate=None, min_rate=None, step=None):
+        RateLimiter.__init__(self, rate)
+        self.init_adaptive_rate(rate, max_rate, min_rate, step)
+
+    def _set_rate(self, rate):
+        super()._set_rate(rate)
+        self.interval = 1 / self.rate
+
+    def record_response(self, latency):
+        """Adjust the rate after a successful response that took latency
+        seconds."""
+        with self._lock:
+            self.adjust_for_response(latency)
+
+    def back_off(self, delay):
+        """Halve the rate, and hold every caller back for delay seconds"""
+        with self._lock:
+            self._set_rate(self.rate / 2)
+            self._next_slot = max(self._next_slot, time.monotonic() + delay)
+
+
+class AsyncTokenBucket:
+    """Rate limiting for coroutines sharing an event loop. Tokens refill at
+    `rate` per second, up to `capacity`, and each request spends one, so
+    short bursts of up to `capacity` requests go out at once while the
+    long-run rate stays at `rate`."""
+
+    def __init__(self, rate, capacity=1):
+        if rate <= 0:
+            raise ValueError("rate must be a positive number of requests.")
+        if capacity < 1:
+            raise ValueError("capacity must be at least one request.")
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        # Nobody gets a token before this time
+        self._paused_until = 0.0
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        # Created lazily so the bucket can be made outside of a running loop.
+        # Waiters queue on the lock, so tokens are handed out in order.
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+class AdaptiveAsyncTokenBucket(AdaptiveRate, AsyncTokenBucket):
+    """An AsyncTokenBucket whose refill rate adapts to the server; see
+    AdaptiveRate."""
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, rate, capacity=1, max_rate=None, min_rate=None,
+                 step=None):
+        AsyncTokenBucket.__init__(self, rate, capacity)
+        self.init_adaptive_rate(rate, max_rate, min_rate, step)
+
+    def record_response(self, latency):
+        """Adjust the rate after a successful response that took latency
+        seconds."""
+        self._refill()
+        self.adjust_for_response(latency)
+
+    def back_off(self, delay):
+        """Halve the rate, and hold every caller back for delay seconds"""
+        self._refill()
+        self._set_rate(self.rate / 2)
+        self._paused_until = max(
+            self._paused_until, time.monotonic() + delay)
@@ -0,0 +1,48 @@
+"""Compression of streamed HTTP responses, negotiated from Accept-Encoding"""
+
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Preferred first when the client accepts several equally
+SUPPORTED_ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+GZIP_LEVEL = 6
+# Brotli's default quality (11) is far too slow to compress on the fly
+BROTLI_QUALITY = 5
+
+
+def choose_encoding(accept_encodings):
+    """Picks the content encoding to respond with, given the request's
+    parsed Accept-Encoding header (werkzeug's request.accept_encodings).
+    Returns None if the response should be sent uncompressed."""
+    best = None
+    best_quality = 0
+    for encoding in SUPPORTED_ENCODINGS:
+        quality = accept_encodings.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress_chunks(chunks, encoding):
+    """Compresses an iterable of bytes chunks with encoding ("gzip" or
+    "br"), yielding compressed chunks as soon as the compressor has output,
+    so the response can be sent before all of it has been generated."""
+    if encoding == "gzip":
+        # wbits=31 writes a gzip header and trailer rather than raw zlib
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        compress, finish = compressor.compress, compressor.flush
+    elif encoding == "br" and brotli is not None:
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        compress, finish = compressor.process, compressor.finish
+    else:
+        raise ValueError(f"Unsupported content encoding: {encoding}")
+
+    for chunk in chunks:
+        compressed = compress(chunk)
+        if compressed:
+            yield compressed
+    yield finish()
@@ -0,0 +1,174 @@
+"""Local SQLite archive of the posts read from threads, so questions about
+a thread's history can be answered without crawling it again"""
+
+import sqlite3
+from datetime import datetime, timezone
+
+from lib.thread_reader import TimestampParsingError
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id TEXT PRIMARY KEY,
+    name TEXT
+);
+CREATE TABLE IF NOT EXISTS pages (
+    thread_id TEXT NOT NULL,
+    page_number INTEGER NOT NULL,
+    post_count INTEGER NOT NULL,
+    PRIMARY KEY (thread_id, page_number)
+);
+CREATE TABLE IF NOT EXISTS posts (
+    post_id TEXT PRIMARY KEY,
+    thread_id TEXT NOT NULL,
+    page_number INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    username TEXT NOT NULL,
+    -- ISO 8601 in UTC, so timestamps sort and compare as text
+    timestamp TEXT
+);
+-- How far each reader of the archive (e.g. a script) has read a thread,
+-- since pages may have been archived by someone else from anywhere
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    reader TEXT NOT NULL,
+    page_number INTEGER NOT NULL,
+    last_post INTEGER NOT NULL,
+    PRIMARY KEY (thread_id, reader)
+);
+CREATE TABLE IF NOT EXISTS images (
+    post_id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    -- 1 if the image only appears inside quotes of other posts
+    quoted INTEGER NOT NULL,
+    PRIMARY KEY (post_id, url)
+);
+CREATE INDEX IF NOT EXISTS posts_by_username
+    ON posts (thread_id, username, timestamp);
+CREATE INDEX IF NOT EXISTS posts_by_timestamp ON posts (thread_id, timestamp);
+CREATE INDEX IF NOT EXISTS images_by_url ON images (url);
+"""
+
+
+def format_timestamp(timestamp):
+    if timestamp is None:
+        return None
+    return timestamp.astimezone(timezone.utc).isoformat()
+
+
+def parse_archived_timestamp(timestamp):
+    return datetime.fromisoformat(timestamp) if timestamp is not None else None
+
+
+class ThreadArchive:
+    """Stores every post read through a Thread, one page at a time. Saving a
+    page again (e.g. the last page of a thread as it fills up) replaces what
+    was stored for it."""
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def save_thread(self, thread_id, name):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO threads VALUES (?, ?)",
+                (str(thread_id), name))
+
+    def save_page(self, thread_id, page_number, posts):
+        thread_id = str(thread_id)
+        post_rows = []
+        image_rows = []
+        for position, post in enumerate(posts):
+            try:
+                timestamp = format_timestamp(post.timestamp)
+            except TimestampParsingError:
+                timestamp = None
+            post_rows.append((post.post_id, thread_id, page_number, position,
+                              post.username, timestamp))
+            image_rows += [(post.post_id, url, quoted)
+                           for url, quoted in post.image_urls_with_quoted()]
+
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM images WHERE post_id IN (SELECT post_id FROM "
+                "posts WHERE thread_id = ? AND page_number = ?)",
+                (thread_id, page_number))
+            self.connection.execute(
+                "DELETE FROM posts WHERE thread_id = ? AND page_number = ?",
+                (thread_id, page_number))
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO posts VALUES (?, ?, ?, ?, ?, ?)",
+                post_rows)
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO images VALUES (?, ?, ?)", image_rows)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?)",
+                (thread_id, page_number, len(post_rows)))
+
+    def last_archived_page(self, thread_id):
+        """Returns (page number, post count) of the last page archived for
+        a thread, or None if none of it has been archived."""
+        return self.connection.execute(
+            "SELECT page_number, post_count FROM pages WHERE thread_id = ? "
+            "ORDER BY page_number DESC LIMIT 1",
+            (str(thread_id),)).fetchone()
+
+    def save_checkpoint(self, thread_id, reader, page_number, last_post):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?)",
+                (str(thread_id), reader, page_number, last_post))
+
+    def checkpoint(self, thread_id, reader):
+        """Returns (page number, last post) that reader last saved for a
+        thread, or None if it has never read the thread. Every page before
+        it was read into the archive by that reader."""
+        return self.connection.execute(
+            "SELECT page_number, last_post FROM checkpoints "
+            "WHERE thread_id = ? AND reader = ?",
+            (str(thread_id), reader)).fetchone()
+
+    def latest_post_per_user(self, thread_id, limit=None,
+                             oldest_first=False):
+        """Returns (username, timestamp) of each poster's most recent post in
+        a thread, most recent first, or least recent first if oldest_first is
+        set. Posters whose post times couldn't be read come last. With a
+        limit, only that many posters are returned."""
+        order = "ASC" if oldest_first else "DESC"
+        rows = self.connection.execute(
+            "SELECT username, MAX(timestamp) AS latest FROM posts "
+            "WHERE thread_id = ? GROUP BY username "
+            f"ORDER BY latest IS NULL, latest {order} LIMIT ?",
+            (str(thread_id), -1 if limit is None else limit))
+        return [(username, parse_archived_timestamp(timestamp))
+                for username, timestamp in rows]
+
+    def posts_with_images(self, image_urls, start=None, end=None,
+                          include_quoted=False):
+        """Returns (username, post id, timestamp, image url) for each post
+        containing any of image_urls, optionally only between the start and
+        end datetimes, oldest first. Images that only appear inside quotes
+        are left out unless include_quoted is set."""
+        image_urls = list(image_urls)
+        conditions = [f"images.url IN ({', '.join('?' * len(image_urls))})"]
+        params = image_urls
+        if not include_quoted:
+            conditions.append("images.quoted = 0")
+        if start is not None:
+            conditions.append("posts.timestamp >= ?")
+            params.append(format_timestamp(start))
+        if end is not None:
+            conditions.append("posts.timestamp < ?")
+            params.append(format_timestamp(end))
+
+        rows = self.connection.execute(
+            "SELECT posts.username, posts.post_id, posts.timestamp, "
+            "images.url FROM images JOIN posts USING (post_id) WHERE "
+            + " AND ".join(conditions) + " ORDER BY posts.timestamp",
+            params)
+        return [(username, post_id, parse_archived_timestamp(timestamp), url)
+                for username, post_id, timestamp, url in rows]
@@ -1,13 +1,26 @@
 """Functionality for reading a thread and parsing out new posts for use"""
 
 import re
-import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 
 import pytz
 
 from bs4 import BeautifulSoup
 
+from lib.page_cache import CachedPage
+
+try:
+    from lxml import html as lxml_html
+except ImportError:
+    lxml_html = None
+
+PARSER_ENGINES = ("lxml", "html.parser")
+# lxml is much faster, but fall back to BeautifulSoup's pure-python parser
+# if it isn't installed
+DEFAULT_PARSER_ENGINE = "lxml" if lxml_html is not None else "html.parser"
+
 
 class ThreadNotFoundError(Exception):
     pass
@@ -26,23 +39,178 @@ def scrape_page_number(response):
     return scrape_redirect_url(response, r"pagenumber=(\d+)")
 
 
-class Thread:
+def scrape_last_read_index(response):
+    """The index of the last read post in a thread, from the redirect for a
+    goto=newpost request"""
+    try:
+        post_number = scrape_redirect_url(response, r"#pti(\d+)")
+    except IndexError:
+        # Noseen behaves exactly the same for threads that are entirely
+        # unread and threads that have no unread replies, if the thread is
+        # only one page long. So, we guess the page has been fully read :/
+        post_number = 40
+
+    posts_per_page = scrape_redirect_url(response, r"perpage=(\d+)")
+    page_number = scrape_page_number(response)
+
+    index = ((posts_per_page * (page_number - 1)) + post_number - 1)
+    return index
+
+
+class BaseThread:
+    """Everything about reading a thread that doesn't make requests: the
+    stopping point, parsing and the page cache. Shared by Thread and
+    AsyncThread, which add the requests."""
+    POSTS_PER_PAGE = 40
+
     def __init__(self, *, dispatcher, thread_id):
         self.dispatcher = dispatcher
         self.thread = thread_id
-        self.last_read_index = self.get_last_read_index()
+        self.last_read_index = None
         self.page_number = 1
         self.last_post = 0
-        self.name = self.get_thread_name()
-        self.set_last_read()
+        self.parser_engine = self.dispatcher.config["DEFAULT"].get(
+            "parser_engine", DEFAULT_PARSER_ENGINE)
+        self.name = None
 
-    def load_previous_stopping_point(self):
+    def read_thread_name(self, raw_page):
+        """The thread's name, from the response for one of its pages"""
+        self.check_thread_is_valid(raw_page)
+        # Strip off " - The Something Awful Forums"
+        name = BeautifulSoup(raw_page.text, "html.parser").title.text[:-29]
+        return name
+
+    def set_name(self, name):
+        self.name = name
+        if self.dispatcher.archive is not None:
+            self.dispatcher.archive.save_thread(self.thread, self.name)
+
+    def load_saved_stopping_point(self):
+        """Load the stopping point saved in config. Returns False if there
+        isn't one."""
         try:
             thread_attrs = self.dispatcher.config[self.thread]
             self.page_number = int(thread_attrs["page"])
             self.last_post = int(thread_attrs["last_post"])
         except KeyError:
             print("No previous endpoint of thread in config. Saving new end.")
+            return False
+        return True
+
+    def check_thread_is_valid(self, raw_page):
+        if "Specified thread was not found in the live forum" in raw_page.text:
+            raise ThreadNotFoundError(f"Thread {self.thread} not accessible.")
+        if "Sorry, you must be a registered forums member" in raw_page.text:
+            raise ThreadNotFoundError(f"""Thread {self.thread} is paywalled.
+            You must enter your login credentials in config.ini to access.""")
+
+    def page_params(self, page_number):
+        return {
+            "threadid": self.thread, "pagenumber": str(page_number),
+            "perpage": str(self.POSTS_PER_PAGE)}
+
+    def page_cache_key(self, page_number):
+        viewer = self.dispatcher.config["DEFAULT"]["username"] \
+            if self.dispatcher.logged_in else "anonymous"
+        return viewer, self.thread, page_number, self.POSTS_PER_PAGE
+
+    def get_cached_page(self, page_number):
+        """The page cache's entry for a page, or None. Full pages can be
+        used as they are; a partial page needs revalidating with a
+        conditional request."""
+        return self.dispatcher.page_cache.get(
+            self.page_cache_key(page_number))
+
+    def page_html_from_response(self, page_number, response, cached):
+        """A page's HTML from the response to a request for it, made with
+        cached's revalidation headers if there was a cached copy. New pages
+        are put in the page cache."""
+        if cached and response.status_code == 304:
+            return cached.html
+
+        if response.status_code < 400 and "The page number you requested" \
+                not in response.text:
+            self.dispatcher.page_cache.put(
+                self.page_cache_key(page_number), CachedPage(
+                    html=response.text,
+                    etag=response.headers.get("ETag"),
+                    last_modified=response.headers.get("Last-Modified")))
+
+        return response.text
+
+    def parse_page(self, page_number, raw_page):
+        if "The page number you requested" in raw_page:
+            print("Last page of thread reached.")
+            return None
+
+        print(f"Parsing posts from {self.name}, page {page_number}")
+        page = Page(raw_page, self.parser_engine)
+        if self.dispatcher.archive is not None:
+            self.dispatcher.archive.save_page(
+                self.thread, page_number, page.posts)
+        self.mark_page_complete(page_number, page)
+        return page
+
+    def mark_page_complete(self, page_number, page):
+        """Full pages never change, so the page cache can serve them without
+        asking the forums again"""
+        if self.dispatcher.page_cache is not None \
+                and len(page.posts) == self.POSTS_PER_PAGE:
+            self.dispatcher.page_cache.mark_complete(
+                self.page_cache_key(page_number))
+
+    def is_last_page(self, page):
+        return not page or len(page.posts) < self.POSTS_PER_PAGE
+
+    def new_posts_on_page(self, page):
+        return page.posts[self.last_post:len(page.posts)]
+
+    def advance_past_page(self, page_number, page):
+        """Move the stopping point to the end of a page that's been read"""
+        new_last_post = len(page.posts)
+        if new_last_post == self.POSTS_PER_PAGE:
+            # Pick up from the top of the next page
+            self.page_number = page_number + 1
+            self.last_post = 0
+        else:
+            self.page_number = page_number
+            self.last_post = new_last_post
+
+    def finish_reading(self, found_posts, save_progress):
+        if found_posts:
+            if save_progress:
+                self.update_config_values()
+        else:
+            print(f"No new posts in thread {self.thread}.")
+
+    def set_last_read_params(self):
+        """Params for the request that puts the forums' read marker back
+        where it was before the thread was read, or None if not needed"""
+        if self.dispatcher.logged_in and self.last_read_index:
+            return {
+                "action": "setseen",
+                "threadid": self.thread,
+                "index": self.last_read_index
+            }
+        return None
+
+    def update_config_values(self):
+        self.dispatcher.config[self.thread] = {
+            "page": self.page_number,
+            "last_post": self.last_post
+        }
+        self.dispatcher.save_config()
+
+
+class Thread(BaseThread):
+    def __init__(self, *, dispatcher, thread_id):
+        super().__init__(dispatcher=dispatcher, thread_id=thread_id)
+        self.last_read_index = self.get_last_read_index()
+        self.set_name(self.get_thread_name())
+        self.set_last_read()
+
+    def load_previous_stopping_point(self):
+        if not self.load_saved_stopping_point():
             self.load_end_of_thread()
             self.update_config_values()
 
@@ -53,42 +221,35 @@ class Thread:
 
     def get_posts_left_til_snipe(self):
         self.load_end_of_thread()
-        posts_left_til_snipe = 40 - self.last_post
+        posts_left_til_snipe = self.POSTS_PER_PAGE - self.last_post
         return posts_left_til_snipe
 
     def get_thread_name(self):
-        raw_page = self.get_raw_page(1)
-        self.check_thread_is_valid(raw_page)
-        # Strip off " - The Something Awful Forums"
-        name = BeautifulSoup(raw_page.text, "html.parser").title.text[:-29]
-        return name
+        return self.read_thread_name(self.get_raw_page(1))
 
-    def check_thread_is_valid(self, raw_page):
-        if "Specified thread was not found in the live forum" in raw_page.text:
-            raise ThreadNotFoundError(f"Thread {self.thread} not accessible.")
-        if "Sorry, you must be a registered forums member" in raw_page.text:
-            raise ThreadNotFoundError(f"""Thread {self.thread} is paywalled.
-            You must enter your login credentials in config.ini to access.""")
+    def get_raw_page(self, page_number, headers=None):
+        return self.dispatcher.get_thread(
+            params=self.page_params(page_number), headers=headers)
 
-    def get_raw_page(self, page_number):
-        payload = {
-            "threadid": self.thread, "pagenumber": str(page_number)}
-        response = self.dispatcher.get_thread(params=payload)
+    def get_page_html(self, page_number):
+        """Get a page's HTML, from the page cache where possible. Full pages
+        are served straight from the cache; a cached partial page is
+        revalidated with a conditional request."""
+        if self.dispatcher.page_cache is None:
+            return self.get_raw_page(page_number).text
 
-        return response
+        cached = self.get_cached_page(page_number)
+        if cached and cached.complete:
+            return cached.html
+
+        response = self.get_raw_page(
+            page_number,
+            headers=cached.revalidation_headers() if cached else None)
+        return self.page_html_from_response(page_number, response, cached)
 
     def get_page(self, page_number=None):
         page_number = self.page_number if page_number is None else page_number
-        raw_page = self.get_raw_page(page_number).text
-        if "The page number you requested" in raw_page:
-            print("Last page of thread reached.")
-            self.page_number -= 1
-            return None
-
-        print(f"Parsing posts from {self.name}, "
-              + f"page {self.page_number}")
-        page = Page(raw_page)
-        return page
+        return self.parse_page(page_number, self.get_page_html(page_number))
 
     def get_last_page_number(self):
         payload = {"threadid": self.thread, "goto": "lastpost"}
@@ -97,38 +258,132 @@ class Thread:
         return scrape_page_number(response)
 
     def get_last_post(self):
-        raw_page = self.get_raw_page(self.page_number).text
-        page = Page(raw_page)
+        raw_page = self.get_page_html(self.page_number)
+        page = Page(raw_page, self.parser_engine)
         return len(page.posts)
 
-    def new_posts(self):
-        new_posts = []
-
+    def fetch_raw_pages(self, first_page, last_page, workers):
+        """Fetch pages first_page..last_page through a pool of workers,
+        yielding (page number, html) in thread order. Only a small window of
+        pages is requested ahead of the consumer at any time; the
+        dispatcher's rate limiter keeps the overall request rate polite."""
+        window = workers * 2
+        page_numbers = iter(range(first_page, last_page + 1))
+        pending = deque()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            def submit_next():
+                page_number = next(page_numbers, None)
+                if page_number is not None:
+                    pending.append((page_number, executor.submit(
+                        self.get_page_html, page_number)))
+
+            for _ in range(window):
+                submit_next()
+
+            while pending:
+                page_number, future = pending.popleft()
+                raw_page = future.result()
+                submit_next()
+                yield page_number, raw_page
+
+    def iter_pages(self, workers=1):
+        """Yield (page number, Page) from the current page to the end of the
+        thread. With more than one worker, the last page number is resolved
+        up front and pages are downloaded ahead of the consumer."""
+        if workers > 1:
+            last_page_number = self.get_last_page_number()
+            for page_number, raw_page in self.fetch_raw_pages(
+                    self.page_number, last_page_number, workers):
+                page = self.parse_page(page_number, raw_page)
+                if not page:
+                    return
+                yield page_number, page
+            return
+
+        page_number = self.page_number
         while True:
-            page = self.get_page()
+            page = self.get_page(page_number)
             if not page:
                 # Last page of thread reached, has 40 posts
-                break
+                return
 
-            new_last_post = len(page.posts)
-            new_posts += page.posts[self.last_post:new_last_post]
-            if new_last_post < 40:
+            yield page_number, page
+            if self.is_last_page(page):
                 # Last page of thread reached
-                self.last_post = new_last_post
-                break
-
-            self.page_number += 1
-            self.last_post = 0
-            # Wait so as not to flood server with requests
-            time.sleep(1)
-
-        if new_posts:
-            self.update_config_values()
-        else:
-            print(f"No new posts in thread {self.thread}.")
-
+                return
+
+            page_number += 1
+
+    def iter_pages_in_processes(self, parse, *, processes, workers=1,
+                                initializer=None, initargs=()):
+        """Yield (page number, parse(html)) from the current page to the end
+        of the thread, with pages parsed in a pool of processes.
+
+        Pages are downloaded by workers threads as in iter_pages, and handed
+        to the pool as they arrive. Results come back in thread order. parse
+        must be a picklable module-level function, and its results must be
+        picklable and have a posts list, like a Page. initializer is run
+        with initargs in each process when it starts.
+        """
+        last_page_number = self.get_last_page_number()
+        raw_pages = self.fetch_raw_pages(
+            self.page_number, last_page_number, workers)
+        window = processes * 2
+        pending = deque()
+
+        with ProcessPoolExecutor(max_workers=processes,
+                                 initializer=initializer,
+                                 initargs=initargs) as executor:
+            def submit_next():
+                page_number, raw_page = next(raw_pages, (None, None))
+                if page_number is None:
+                    return
+                if "The page number you requested" in raw_page:
+                    print("Last page of thread reached.")
+                    raw_pages.close()
+                    return
+                pending.append((page_number, executor.submit(
+                    parse, raw_page)))
+
+            for _ in range(window):
+                submit_next()
+
+            while pending:
+                page_number, future = pending.popleft()
+                page = future.result()
+                submit_next()
+                print(f"Parsed posts from {self.name}, page {page_number}")
+                self.mark_page_complete(page_number, page)
+                yield page_number, page
+
+    def iter_new_posts(self, workers=1, save_progress=True, pages=None):
+        """Yield new posts one page at a time, starting from the current
+        stopping point.
+
+        The stopping point (page_number and last_post) advances as each page
+        is consumed, so only one page's worth of posts is held here at once.
+        When the thread has been read to the end, the stopping point is saved
+        to config if save_progress is set and the read marker is restored.
+
+        Pages come from iter_pages(workers), unless another iterable of
+        (page number, page) starting at the stopping point is given as pages.
+        """
+        found_posts = False
+        if pages is None:
+            pages = self.iter_pages(workers)
+
+        for page_number, page in pages:
+            posts = self.new_posts_on_page(page)
+            found_posts = found_posts or bool(posts)
+            yield from posts
+            self.advance_past_page(page_number, page)
+
+        self.finish_reading(found_posts, save_progress)
         self.set_last_read()
-        return new_posts
+
+    def new_posts(self, workers=1):
+        return list(self.iter_new_posts(workers))
 
     # This method assumes that the thread has been read at some point.
     # If the thread is totally unread, it will set the last-read marker such
@@ -140,52 +395,47 @@ class Thread:
         response = self.dispatcher.get_thread(
             params={"threadid": self.thread, "goto": "newpost"},
             allow_redirects=False)
-
-        try:
-            post_number = scrape_redirect_url(response, r"#pti(\d+)")
-        except IndexError:
-            # Noseen behaves exactly the same for threads that are entirely
-            # unread and threads that have no unread replies, if the thread is
-            # only one page long. So, we guess the page has been fully read :/
-            post_number = 40
-
-        posts_per_page = scrape_redirect_url(response, r"perpage=(\d+)")
-        page_number = scrape_page_number(response)
-
-        index = ((posts_per_page * (page_number - 1)) + post_number - 1)
-        return index
+        return scrape_last_read_index(response)
 
     def set_last_read(self):
-        if self.dispatcher.logged_in and self.last_read_index:
-            self.dispatcher.get_thread(params={
-                "action": "setseen",
-                "threadid": self.thread,
-                "index": self.last_read_index
-            })
-
-    def update_config_values(self):
-        self.dispatcher.config[self.thread] = {
-            "page": self.page_number,
-            "last_post": self.last_post
-        }
-        self.dispatcher.save_config()
+        params = self.set_last_read_params()
+        if params:
+            self.dispatcher.get_thread(params=params)
 
 
 class Page:
-    def __init__(self, raw_page):
-        self.soup = BeautifulSoup(raw_page, "html.parser")
-        self.thread = self.soup.body["data-thread"]
+    """Parses a page of posts. The parse tree is thrown away once the posts
+    have been pulled out of it, so a Page only holds plain Post records."""
+
+    def __init__(self, raw_page, engine=None):
+        self.engine = engine or DEFAULT_PARSER_ENGINE
         self.posts = []
         self.unread_posts = []
         self.read_posts = []
-        self.parse_posts()
+
+        if self.engine == "lxml":
+            if lxml_html is None:
+                raise ValueError("The lxml parser engine requires lxml. " +
+                                 "Run pip3 install -r requirements.txt.")
+            root = lxml_html.fromstring(raw_page)
+            self.thread = root.body.get("data-thread")
+            selected = root.xpath("//option[@selected='selected']/@value")
+            self.number = int(selected[0]) if selected else None
+            self.parse_posts(map(post_from_lxml, list(root.iter("table"))))
+        elif self.engine == "html.parser":
+            soup = BeautifulSoup(raw_page, "html.parser")
+            self.thread = soup.body["data-thread"]
+            selected = soup.find("option", selected="selected")
+            self.number = int(selected["value"]) if selected else None
+            self.parse_posts(map(post_from_soup, soup.find_all("table")))
+        else:
+            raise ValueError(f"Unknown parser engine {self.engine}. " +
+                             f"Choose from {', '.join(PARSER_ENGINES)}.")
 
     # Posts will currently all return as unread if the user does not have the
     # option selected to mark read posts in a different color.
-    def parse_posts(self):
-        raw_posts = self.soup.find_all("table")
-        for raw_post in raw_posts:
-            post = Post(raw_post)
+    def parse_posts(self, posts):
+        for post in posts:
             if post.username == "Adbot":
                 continue
             self.posts.append(post)
@@ -194,76 +444,173 @@ class Page:
             else:
                 self.read_posts.append(post)
 
-    @property
-    def number(self):
-        return int(self.soup.find("option", selected="selected")["value"])
 
+def parse_timestamp(raw):
+    # Remove the # and ? signs and extra whitespace
+    timestamp = raw.translate({35: None, 63: None}).strip()
 
-class Post:
-    CELL_TAG = "td"
+    if 'AM' in timestamp or 'PM' in timestamp:
+        parsed = datetime.strptime(timestamp, "%b %d, %Y %I:%M %p")
+    else:
+        parsed = datetime.strptime(timestamp, "%b %d, %Y %H:%M")
 
-    def __init__(self, raw_post):
-        self.raw_post = raw_post
+    return parsed.astimezone(pytz.timezone('utc'))
 
-        self.cells = self.raw_post.find_all(self.CELL_TAG)
-        self.username = self.raw_post.find(self.CELL_TAG, "userinfo").dt.text
-        # id attribute has "post" at the beginning, so we strip it
-        self.post_id = self.raw_post["id"][4::]
-        self.index = self.raw_post["data-idx"]
-        self.body = self.raw_post.find(self.CELL_TAG, "postbody")
 
+def post_link(post_id):
+    return "https://forums.somethingawful.com/showthread.php?goto=post&" \
+           f"postid={post_id}#post{post_id}"
+
+
+class Post:
+    """Everything we use from a post, pulled out of the page at parse time.
+    Holds no references into the parse tree, so posts are small and cheap to
+    pickle."""
+
+    __slots__ = ("username", "post_id", "index", "avatar_url", "is_unread",
+                 "_raw_timestamp", "_timestamp", "_text", "_unquoted_text",
+                 "_image_urls", "_unquoted_image_urls", "_quotes_removed")
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, *, username, post_id, index, avatar_url, is_unread,
+                 raw_timestamp, text, unquoted_text, image_urls,
+                 unquoted_image_urls):
+        self.username = username
+        self.post_id = post_id
+        self.index = index
+        self.avatar_url = avatar_url
+        self.is_unread = is_unread
+        self._raw_timestamp = raw_timestamp
         self._timestamp = None
+        self._text = text
+        self._unquoted_text = unquoted_text
+        self._image_urls = image_urls
+        self._unquoted_image_urls = unquoted_image_urls
+        self._quotes_removed = False
 
     @property
     def text(self):
-        return self.body.get_text()
+        return self._unquoted_text if self._quotes_removed else self._text
 
     @property
     def timestamp(self):
         if self._timestamp is None:
-            try:
-                raw = self.raw_post.find(self.CELL_TAG, "postdate").text
-                # Remove the # and ? signs and extra whitespace
-                timestamp = raw.translate({35: None, 63: None}).strip()
-            except AttributeError as exc:
+            if self._raw_timestamp is None:
                 raise TimestampParsingError(
-                    "Parsing error. Could not parse timestamp.") from exc
+                    "Parsing error. Could not parse timestamp.")
 
-            if 'AM' in timestamp or 'PM' in timestamp:
-                parsed = datetime.strptime(timestamp, "%b %d, %Y %I:%M %p")
-            else:
-                parsed = datetime.strptime(timestamp, "%b %d, %Y %H:%M")
-
-            self._timestamp = parsed.astimezone(pytz.timezone('utc'))
+            self._timestamp = parse_timestamp(self._raw_timestamp)
 
         return self._timestamp
 
-    @property
-    def avatar_url(self):
-        # Always grabs actual avatar image. May need special case for Fungah!
-        try:
-            return self.raw_post.find(self.CELL_TAG, "userinfo").img["src"]
-        # User has no avatar
-        except TypeError:
-            return ""
-
-    @property
-    def is_unread(self):
-        # Read posts have a first "tr" with class "seen1" or "seen2"
-        # Unread posts have "altcolor1" or "altcolor2"
-        # Use matching for unread so if this breaks all posts default to read
-        return "altcolor" in self.raw_post.tr["class"][0]
-
     @property
     def link(self):
-        return "https://forums.somethingawful.com/showthread.php?goto=post&" \
-               f"postid={self.post_id}#post{self.post_id}"
+        return post_link(self.post_id)
 
     def remove_quotes(self):
-        quotes = self.body.find_all("div", "bbc-block")
-        for quote in quotes:
-            quote.decompose()
+        self._quotes_removed = True
 
     def image_urls(self):
-        images = self.body.find_all("img")
-        return list(map(lambda img: img["src"], images))
+        if self._quotes_removed:
+            return list(self._unquoted_image_urls)
+        return list(self._image_urls)
+
+    def image_urls_with_quoted(self):
+        """Returns (url, quoted) for each distinct image in the post, where
+        quoted is True if the image only appears inside quotes."""
+        unquoted = set(self._unquoted_image_urls)
+        return [(url, url not in unquoted)
+                for url in dict.fromkeys(self._image_urls)]
+
+
+CELL_TAG = "td"
+
+
+def post_from_soup(raw_post):
+    userinfo = raw_post.find(CELL_TAG, "userinfo")
+    body = raw_post.find(CELL_TAG, "postbody")
+    postdate = raw_post.find(CELL_TAG, "postdate")
+
+    text = body.get_text()
+    image_urls = [img["src"] for img in body.find_all("img")]
+    quotes = body.find_all("div", "bbc-block")
+    for quote in quotes:
+        quote.decompose()
+    if quotes:
+        unquoted_text = body.get_text()
+        unquoted_image_urls = [img["src"] for img in body.find_all("img")]
+    else:
+        unquoted_text, unquoted_image_urls = text, image_urls
+
+    # Always grabs actual avatar image. May need special case for Fungah!
+    avatar = userinfo.img
+
+    return Post(
+        username=userinfo.dt.text,
+        # id attribute has "post" at the beginning, so we strip it
+        post_id=raw_post["id"][4::],
+        index=raw_post["data-idx"],
+        # User has no avatar if there's no image
+        avatar_url=avatar["src"] if avatar else "",
+        # Read posts have a first "tr" with class "seen1" or "seen2"
+        # Unread posts have "altcolor1" or "altcolor2"
+        # Use matching for unread so if this breaks all posts default to read
+        is_unread="altcolor" in raw_post.tr["class"][0],
+        raw_timestamp=postdate.text if postdate else None,
+        text=text,
+        unquoted_text=unquoted_text,
+        image_urls=image_urls,
+        unquoted_image_urls=unquoted_image_urls,
+    )
+
+
+def has_class(element, class_name):
+    return class_name in element.get("class", "").split()
+
+
+def post_from_lxml(raw_post):
+    """Same as post_from_soup, but all the cells we care about are found in a
+    single walk over the post instead of one search per field."""
+    first_row = userinfo = body = postdate = None
+
+    for element in raw_post.iter("tr", CELL_TAG):
+        if element.tag == "tr":
+            if first_row is None:
+                first_row = element
+        elif has_class(element, "userinfo"):
+            if userinfo is None:
+                userinfo = element
+        elif has_class(element, "postbody"):
+            if body is None:
+                body = element
+        elif has_class(element, "postdate"):
+            if postdate is None:
+                postdate = element
+
+    text = body.text_content()
+    image_urls = [img.get("src") for img in body.iter("img")]
+    quotes = [div for div in body.iter("div") if has_class(div, "bbc-block")]
+    for quote in quotes:
+        quote.drop_tree()
+    if quotes:
+        unquoted_text = body.text_content()
+        unquoted_image_urls = [img.get("src") for img in body.iter("img")]
+    else:
+        unquoted_text, unquoted_image_urls = text, image_urls
+
+    avatar = next(userinfo.iter("img"), None)
+    row_classes = first_row.get("class", "").split()
+
+    return Post(
+        username=next(userinfo.iter("dt")).text_content(),
+        post_id=raw_post.get("id")[4::],
+        index=raw_post.get("data-idx"),
+        avatar_url=avatar.get("src", "") if avatar is not None else "",
+        is_unread=bool(row_classes) and "altcolor" in row_classes[0],
+        raw_timestamp=(postdate.text_content()
+                       if postdate is not None else None),
+        text=text,
+        unquoted_text=unquoted_text,
+        image_urls=image_urls,
+        unquoted_image_urls=unquoted_image_urls,
+    )
@@ -0,0 +1,45 @@
+"""Fast lookup of whether a timestamp falls inside a set of time windows"""
+
+from bisect import bisect_left
+
+
+class TimeWindowIndex:
+    """Merges time windows ({'start_time': ..., 'end_time': ...} dicts, as
+    built by FirebaseHandler) into sorted, non-overlapping windows so a
+    timestamp can be checked with a binary search. Windows are exclusive at
+    both ends."""
+
+    def __init__(self, windows):
+        self.starts = []
+        self.ends = []
+        for window in sorted(windows, key=lambda w: w['start_time']):
+            start, end = window['start_time'], window['end_time']
+            if self.ends and start < self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def contains(self, timestamp):
+        # The last window starting strictly before the timestamp is the only
+        # one that could contain it
+        position = bisect_left(self.starts, timestamp) - 1
+        return position >= 0 and timestamp < self.ends[position]
+
+    def contains_many(self, timestamps):
+        """Check a batch of timestamps in one sorted sweep. Returns a list of
+        booleans in the same order as timestamps."""
+        results = [False] * len(timestamps)
+        order = sorted(range(len(timestamps)), key=timestamps.__getitem__)
+        position = 0
+        for i in order:
+            timestamp = timestamps[i]
+            while position < len(self.starts) \
+                    and self.ends[position] <= timestamp:
+                position += 1
+            results[i] = position < len(self.starts) \
+                and self.starts[position] < timestamp
+        return results
@@ -0,0 +1,92 @@
+"""Local snapshot of the eligible trophy catalog, so it only needs to be
+rebuilt from the db when something in it has changed"""
+
+import json
+import os
+import time
+from datetime import datetime
+
+from lib.helpers import atomic_write
+
+SNAPSHOT_VERSION = 2
+
+
+class TrophyCatalogSnapshot:
+    """Stores each year's catalog (image URL -> game, name, time window and
+    trophy document path) and its all-trophies event windows in one JSON
+    file, tagged with the change token the catalog was built against.
+
+    The change token can't see every edit (e.g. a game's time window being
+    changed in the console), so a snapshot is also only trusted for max_age
+    seconds after it was built.
+    """
+
+    def __init__(self, path, max_age=None):
+        self.path = path
+        self.max_age = max_age
+
+    def _read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                snapshot = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            return {}
+        return snapshot.get("years", {})
+
+    def load(self, year, change_token, make_reference):
+        """Returns (trophy dict, all-trophies event windows) if there is a
+        snapshot for year built against change_token, otherwise None.
+        make_reference turns a stored document path back into a reference."""
+        entry = self._read().get(str(year))
+        if not entry or entry["change_token"] != change_token:
+            return None
+        if self.max_age is not None \
+                and time.time() - entry["built_at"] > self.max_age:
+            return None
+
+        trophies = {
+            image_url: {
+                "game": trophy["game"],
+                "name": trophy["name"],
+                "reference": make_reference(trophy["reference"]),
+                "start_time": datetime.fromisoformat(trophy["start_time"]),
+                "end_time": datetime.fromisoformat(trophy["end_time"]),
+            }
+            for image_url, trophy in entry["trophies"].items()
+        }
+        windows = [
+            {"start_time": datetime.fromisoformat(window["start_time"]),
+             "end_time": datetime.fromisoformat(window["end_time"])}
+            for window in entry["all_trophies_event_windows"]
+        ]
+        return trophies, windows
+
+    def save(self, year, change_token, trophies, windows):
+        years = self._read()
+        years[str(year)] = {
+            "change_token": change_token,
+            "built_at": time.time(),
+            "trophies": {
+                image_url: {
+                    "game": trophy["game"],
+                    "name": trophy["name"],
+                    "reference": trophy["reference"].path,
+                    "start_time": trophy["start_time"].isoformat(),
+                    "end_time": trophy["end_time"].isoformat(),
+                }
+                for image_url, trophy in trophies.items()
+            },
+            "all_trophies_event_windows": [
+                {"start_time": window["start_time"].isoformat(),
+                 "end_time": window["end_time"].isoformat()}
+                for window in windows
+            ],
+        }
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with atomic_write(self.path, "w", encoding="utf-8") as file:
+            json.dump({"version": SNAPSHOT_VERSION, "years": years}, file)
@@ -0,0 +1,64 @@
+"""Fast lookup of which trophies a posted image URL corresponds to"""
+
+import re
+from urllib.parse import urlsplit
+
+
+def normalize_url(url):
+    """Reduce an absolute URL to host + path, so that http/https, "www.",
+    query strings and fragments don't prevent a match. Returns None for
+    relative URLs."""
+    parts = urlsplit(url.strip())
+    if not parts.netloc:
+        return None
+
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    return host + parts.path
+
+
+class TrophyMatcher:
+    """Built once from the trophy image URLs, then used to look up every
+    image in the thread.
+
+    An image whose normalized URL is exactly a trophy's is that trophy, and
+    nothing else is checked. Otherwise every trophy URL found anywhere in
+    the image URL matches, as when each trophy was searched for in turn:
+    all trophy URLs are compiled into one pattern that finds the longest
+    one at each position of the image URL in a single scan, and any shorter
+    trophy URLs starting at the same position are picked out from it.
+    """
+
+    def __init__(self, trophy_urls):
+        self.exact = {}
+        for trophy_url in trophy_urls:
+            normalized = normalize_url(trophy_url)
+            if normalized is not None:
+                self.exact.setdefault(normalized, []).append(trophy_url)
+
+        self.trophy_urls = set(trophy_urls)
+        # Longest first, so each position reports the longest trophy URL
+        # starting there. The lookahead lets matches overlap.
+        alternatives = sorted(self.trophy_urls, key=len, reverse=True)
+        self.pattern = re.compile(
+            "(?=(" + "|".join(map(re.escape, alternatives)) + "))"
+        ) if alternatives else None
+
+    def match(self, image_url):
+        """Returns the trophy URLs matching image_url, in the order found."""
+        exact = self.exact.get(normalize_url(image_url))
+        if exact:
+            return list(exact)
+
+        matches = []
+        if self.pattern is not None:
+            for found in self.pattern.finditer(image_url):
+                longest = found.group(1)
+                for end in range(len(longest), 0, -1):
+                    trophy_url = longest[:end]
+                    if trophy_url in self.trophy_urls \
+                            and trophy_url not in matches:
+                        matches.append(trophy_url)
+
+        return matches
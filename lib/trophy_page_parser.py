@@ -0,0 +1,68 @@
+"""Trophy extraction from raw thread pages, for running in worker processes
+during full thread rescans. Only imports what parsing needs, so that worker
+processes don't set up a db connection of their own."""
+
+from lib.thread_reader import Page, TimestampParsingError, post_link
+from lib.trophy_matcher import TrophyMatcher
+
+# Set in each worker process by init_worker
+_engine = None
+_matcher = None
+
+
+class TrophyPost:
+    """The parts of a post the trophy scanner needs, small enough to send
+    back from a worker process cheaply."""
+
+    __slots__ = ("username", "post_id", "_timestamp", "trophy_keys")
+
+    def __init__(self, username, post_id, timestamp, trophy_keys):
+        self.username = username
+        self.post_id = post_id
+        self._timestamp = timestamp
+        # Keys of the eligible trophies whose images are in the post
+        self.trophy_keys = trophy_keys
+
+    @property
+    def timestamp(self):
+        if self._timestamp is None:
+            raise TimestampParsingError(
+                "Parsing error. Could not parse timestamp.")
+
+        return self._timestamp
+
+    @property
+    def link(self):
+        return post_link(self.post_id)
+
+
+class TrophyPage:
+    __slots__ = ("posts",)
+
+    def __init__(self, posts):
+        self.posts = posts
+
+
+def init_worker(engine, trophy_urls):
+    global _engine, _matcher
+    _engine = engine
+    _matcher = TrophyMatcher(trophy_urls)
+
+
+def parse_trophy_page(raw_page):
+    """Parse a page and match its posts' images (outside of quotes) against
+    the trophy images. Returns a TrophyPage."""
+    posts = []
+    for post in Page(raw_page, _engine).posts:
+        post.remove_quotes()
+        trophy_keys = tuple(
+            trophy_key for image in post.image_urls()
+            for trophy_key in _matcher.match(image))
+        try:
+            timestamp = post.timestamp
+        except TimestampParsingError:
+            timestamp = None
+        posts.append(TrophyPost(
+            post.username, post.post_id, timestamp, trophy_keys))
+
+    return TrophyPage(posts)
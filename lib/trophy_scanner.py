@@ -1,13 +1,29 @@
 """Functionality for parsing IZGC thread for new trophies"""
 
 import json
-import re
+from itertools import islice
 
 from lib.thread_reader import Thread
+from lib.bundle_generator import BundleGenerator
 from lib.firebase_handler import FirebaseHandler
 from lib.helpers import datetime_formatted_est
+from lib.time_windows import TimeWindowIndex
+from lib.trophy_page_parser import parse_trophy_page
+from lib.trophy_page_parser import init_worker as init_trophy_page_parser
+from lib.trophy_matcher import TrophyMatcher
 
-fb_handler = FirebaseHandler()
+# Created on first use rather than at import, so processes that only import
+# this module (e.g. parse processes re-importing the main script under the
+# spawn start method) never open a db connection
+_fb_handler = None
+
+
+def get_fb_handler():
+    global _fb_handler
+    if _fb_handler is None:
+        _fb_handler = FirebaseHandler()
+
+    return _fb_handler
 
 
 def update_trophy_dict(existing_trophies, new_trophies):
@@ -18,6 +34,15 @@ def update_trophy_dict(existing_trophies, new_trophies):
             existing_trophies[game].update(game_trophies)
 
 
+def earned_trophy(post, trophy_data):
+    return {trophy_data["game"]: {
+        trophy_data["name"]: {
+            "timestamp": post.timestamp,
+            "link": post.link,
+            "reference": trophy_data["reference"]
+        }}}
+
+
 class TrophyReporter:
     def __init__(self, imp_trophies):
         self.trophy_log_file = "trophy_timestamps.json"
@@ -40,9 +65,14 @@ class TrophyReporter:
             print("No new trophies found.")
             return
 
+        fb_handler = get_fb_handler()
+        write_summary = fb_handler.write_all_trophies_to_db(self.imp_trophies)
+        # Stored bundles of these imps' trophies are now out of date
+        BundleGenerator(fb_handler).invalidate_bundles(
+            write_summary['collections'])
+
         print("\n******** NEW TROPHIES ********")
         for imp, trophies in self.imp_trophies.items():
-            fb_handler.write_trophies_to_db(imp, trophies)
             # ugly gross way to remove db references, for now
             for game, game_trophies in trophies.items():
                 for _game_trophy, data in game_trophies.items():
@@ -66,26 +96,54 @@ class TrophyReporter:
 
             self.write_trophy_log_to_file()
 
+        print(f"Saved {write_summary['committed']} trophies to db.")
+        if write_summary['failed']:
+            print(f"*** Failed to save {len(write_summary['failed'])} " +
+                  "trophies to db:")
+            for path in write_summary['failed']:
+                print(f"  {path}")
+
 
 class IZGCThread(Thread):
     """Thread with additional functionality for trophy scanning"""
     def __init__(self, *, dispatcher, year_override=None):
         self.dispatcher = dispatcher
+        self.fb_handler = get_fb_handler()
+        self._trophy_matcher = None
+        self._all_trophies_windows = None
         if year_override:
-            fb_handler.year = year_override
+            self.fb_handler.year = year_override
         super().__init__(
             dispatcher=dispatcher,
             thread_id=dispatcher.config["DEFAULT"]["izgc_thread_id"]
         )
 
-    def trophy_scan(self):
-        post_list = self.new_posts()
+    def trophy_scan(self, workers=1, parse_processes=1):
+        """Scan new posts for trophies. With more than one parse process,
+        pages are parsed and matched against trophy images in a pool of
+        processes, which can speed up long rescans on machines with several
+        cores."""
         imp_trophies = {}
 
-        for post in post_list:
-            post.remove_quotes()
-            post_trophies = self.get_post_trophies(post)
-            if post_trophies:
+        if parse_processes > 1:
+            pages = self.iter_pages_in_processes(
+                parse_trophy_page, processes=parse_processes,
+                workers=workers, initializer=init_trophy_page_parser,
+                initargs=(self.parser_engine,
+                          list(self.fb_handler.eligible_trophies)))
+            matched_posts = (
+                (post, post.trophy_keys)
+                for post in self.iter_new_posts(pages=pages))
+        else:
+            matched_posts = (
+                (post, self.match_post_trophies(post))
+                for post in self.iter_new_posts(workers=workers))
+
+        # Check the time windows of a page's worth of matches at a time
+        while batch := list(islice(matched_posts, self.POSTS_PER_PAGE)):
+            for post, post_trophies in self.get_matched_trophies_many(batch):
+                if not post_trophies:
+                    continue
                 if post.username not in imp_trophies:
                     imp_trophies[post.username] = post_trophies
                 else:
@@ -94,31 +152,65 @@ class IZGCThread(Thread):
 
         return imp_trophies
 
+    @property
+    def trophy_matcher(self):
+        if self._trophy_matcher is None:
+            self._trophy_matcher = TrophyMatcher(
+                self.fb_handler.eligible_trophies)
+
+        return self._trophy_matcher
+
+    @property
+    def all_trophies_windows(self):
+        if self._all_trophies_windows is None:
+            # Event windows are gathered while loading the eligible trophies
+            _ = self.fb_handler.eligible_trophies
+            self._all_trophies_windows = TimeWindowIndex(
+                self.fb_handler.all_trophies_event_windows)
+
+        return self._all_trophies_windows
+
+    def match_post_trophies(self, post):
+        """Quotes are removed from the post, so quoted trophies don't count"""
+        post.remove_quotes()
+        return [trophy_path for image in post.image_urls()
+                for trophy_path in self.trophy_matcher.match(image)]
+
     def get_post_trophies(self, post):
+        return self.get_matched_trophies(
+            post, self.match_post_trophies(post))
+
+    def get_matched_trophies(self, post, trophy_paths):
         earned_trophies = {}
-        images = post.image_urls()
-        for image in images:
-            for trophy_path, trophy_data in \
-                    fb_handler.eligible_trophies.items():
-                if re.search(trophy_path, image):
-                    # only record trophies in valid time windows
-                    if not self.valid_post_timestamp(
-                            trophy_data, post.timestamp):
-                        continue
-
-                    new_trophy = {trophy_data["game"]: {
-                        trophy_data["name"]: {
-                            "timestamp": post.timestamp,
-                            "link": post.link,
-                            "reference": trophy_data["reference"]
-                        }}}
-
-                    update_trophy_dict(earned_trophies, new_trophy)
+        for trophy_path in trophy_paths:
+            trophy_data = self.fb_handler.eligible_trophies[trophy_path]
+            # only record trophies in valid time windows
+            if self.valid_post_timestamp(trophy_data, post.timestamp):
+                update_trophy_dict(
+                    earned_trophies, earned_trophy(post, trophy_data))
 
         return earned_trophies
 
-    @staticmethod
-    def valid_post_timestamp(trophy_data, post_timestamp):
+    def get_matched_trophies_many(self, matched_posts):
+        """Bulk version of get_matched_trophies for a list of (post, trophy
+        paths) pairs, checking every match's time window in one call to
+        valid_post_timestamps. Returns (post, earned trophies) pairs."""
+        matches = [(post, self.fb_handler.eligible_trophies[trophy_path])
+                   for post, trophy_paths in matched_posts
+                   for trophy_path in trophy_paths]
+        valid = self.valid_post_timestamps(
+            [(trophy_data, post.timestamp) for post, trophy_data in matches])
+
+        earned_trophies = {id(post): {} for post, _paths in matched_posts}
+        for (post, trophy_data), is_valid in zip(matches, valid):
+            if is_valid:
+                update_trophy_dict(earned_trophies[id(post)],
+                                   earned_trophy(post, trophy_data))
+
+        return [(post, earned_trophies[id(post)])
+                for post, _paths in matched_posts]
+
+    def valid_post_timestamp(self, trophy_data, post_timestamp):
         if (
                 trophy_data['start_time'] <
                 post_timestamp <
@@ -126,8 +218,18 @@ class IZGCThread(Thread):
         ):
             return True
 
-        for window in fb_handler.all_trophies_event_windows:
-            if window['start_time'] < post_timestamp < window['end_time']:
-                return True
-
-        return False
+        return self.all_trophies_windows.contains(post_timestamp)
+
+    def valid_post_timestamps(self, trophy_timestamps):
+        """Bulk version of valid_post_timestamp for a list of
+        (trophy_data, post_timestamp) pairs. Returns a list of booleans."""
+        results = [trophy_data['start_time'] < timestamp <
+                   trophy_data['end_time']
+                   for trophy_data, timestamp in trophy_timestamps]
+        outside = [i for i, valid in enumerate(results) if not valid]
+        in_event_window = self.all_trophies_windows.contains_many(
+            [trophy_timestamps[i][1] for i in outside])
+        for i, valid in zip(outside, in_event_window):
+            results[i] = valid
+
+        return results
@@ -0,0 +1,80 @@
+import argparse
+import http.client
+import logging
+import threading
+import time
+
+from waitress.server import create_server
+
+from app.entrypoint import app
+
+parser = argparse.ArgumentParser(
+    description=('Compare how many random flag redirects per second the web ' +
+                 'app serves under waitress, with and without the WSGI fast ' +
+                 'path.'))
+parser.add_argument(
+    '--seconds',
+    metavar='{number}',
+    type=float,
+    default=5,
+    help='(optional) how long to run each benchmark for. Defaults to 5.')
+parser.add_argument(
+    '--clients',
+    metavar='{number}',
+    type=int,
+    default=8,
+    help=('(optional) number of concurrent keep-alive connections. ' +
+          'Defaults to 8.'))
+parser.add_argument(
+    '--path',
+    default='/images/random-flag-with-creator',
+    help=('(optional) route to request. Defaults to ' +
+          '/images/random-flag-with-creator.'))
+
+
+def hammer(port, path, deadline, counts, index):
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    count = 0
+    while time.perf_counter() < deadline:
+        connection.request('GET', path)
+        response = connection.getresponse()
+        response.read()
+        if response.status != 302:
+            raise RuntimeError(f'Unexpected response status {response.status}')
+        count += 1
+    connection.close()
+    counts[index] = count
+
+
+def benchmark(wsgi_app, args):
+    server = create_server(wsgi_app, host='127.0.0.1', port=0,
+                           threads=args.clients)
+    server_thread = threading.Thread(target=server.run, daemon=True)
+    server_thread.start()
+
+    counts = [0] * args.clients
+    deadline = time.perf_counter() + args.seconds
+    clients = [
+        threading.Thread(target=hammer, args=(
+            server.effective_port, args.path, deadline, counts, i))
+        for i in range(args.clients)
+    ]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+
+    server.close()
+    return sum(counts) / args.seconds
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    # waitress warns every time all its threads are busy, which is the point
+    logging.getLogger('waitress.queue').setLevel(logging.ERROR)
+    # app.wsgi_app is the fast path; the app it wraps is plain Flask
+    fast_path = app.wsgi_app
+    flask_only = fast_path.app
+
+    for label, wsgi_app in (('flask', flask_only), ('fast path', fast_path)):
+        print(f'{label}: {benchmark(wsgi_app, args):.0f} requests/s')
@@ -0,0 +1,64 @@
+import argparse
+import gzip
+import pickle
+import time
+
+from lib.thread_reader import Page, PARSER_ENGINES, lxml_html
+
+parser = argparse.ArgumentParser(
+    description=('Compare how many thread pages per second each parser ' +
+                 'engine can handle. Accepts captured pages as .html files, ' +
+                 '.html.gz files from the page cache, or the .pkl output of ' +
+                 'html_debug.'))
+parser.add_argument(
+    'pages',
+    metavar='{file}',
+    nargs='+',
+    help='captured thread pages to parse')
+parser.add_argument(
+    '--repeat',
+    metavar='{number}',
+    type=int,
+    default=5,
+    help='(optional) number of times to parse each page. Defaults to 5.')
+
+
+def load_page(path):
+    if path.endswith(".pkl"):
+        with open(path, "rb") as file:
+            return pickle.load(file).text
+    if path.endswith(".gz"):
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            return file.read()
+    with open(path, "r", encoding="utf-8") as file:
+        return file.read()
+
+
+def benchmark(engine, raw_pages, repeat):
+    start = time.perf_counter()
+    post_count = 0
+    for _ in range(repeat):
+        for raw_page in raw_pages:
+            page = Page(raw_page, engine)
+            # Touch the fields the trophy scanner uses, so lazily computed
+            # values are counted too
+            for post in page.posts:
+                post.remove_quotes()
+                post.image_urls()
+                post_count += 1
+    elapsed = time.perf_counter() - start
+    return len(raw_pages) * repeat / elapsed, post_count / elapsed
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    pages = [load_page(path) for path in args.pages]
+
+    for parser_engine in PARSER_ENGINES:
+        if parser_engine == "lxml" and lxml_html is None:
+            print(f"{parser_engine}: not installed, skipping")
+            continue
+        pages_per_second, posts_per_second = benchmark(
+            parser_engine, pages, args.repeat)
+        print(f"{parser_engine}: {pages_per_second:.1f} pages/s, " +
+              f"{posts_per_second:.0f} posts/s")
@@ -114,3 +114,6 @@ if __name__ == "__main__":
     dicty = get_trophy_dict()
     for new_trophy in dicty.items():
         add_new_trophy(**new_trophy[1])
+    # Let the trophy scanner know its local copy of the catalog is stale
+    db.document("meta/trophyCatalog").set(
+        {"updatedAt": firestore.SERVER_TIMESTAMP})
@@ -26,6 +26,25 @@ parser.add_argument(
     help=('(optional) the year to scan for trophies from. Used to scan for ' +
           'trophies from a previous year.')
 )
+parser.add_argument(
+    '--workers',
+    metavar='{number}',
+    type=int,
+    default=1,
+    help=('(optional) number of pages to download at once. Useful with ' +
+          '--all-pages. The overall request rate starts at ' +
+          'requests_per_second in config.ini, and only speeds up to ' +
+          'max_requests_per_second if that is set higher.')
+)
+parser.add_argument(
+    '--parse-processes',
+    metavar='{number}',
+    type=int,
+    default=1,
+    help=('(optional) number of processes to parse pages in. Parsing is ' +
+          'usually the bottleneck of --all-pages scans, so set this to the ' +
+          'number of CPU cores for those.')
+)
 
 
 if __name__ == '__main__':
@@ -45,6 +64,7 @@ if __name__ == '__main__':
     else:
         club_thread.load_previous_stopping_point()
 
-    imp_trophies = club_thread.trophy_scan()
+    imp_trophies = club_thread.trophy_scan(
+        workers=args.workers, parse_processes=args.parse_processes)
     reporter = TrophyReporter(imp_trophies)
     reporter.report_new_trophies()
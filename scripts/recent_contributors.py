@@ -5,44 +5,86 @@ from lib.thread_reader import Thread
 from lib.helpers import use_single_thread_id_args, datetime_formatted_est
 
 
-def by_time(user_post):
-    return user_post[1].timestamp
+# Pages archived by the trophy scanner start wherever its own checkpoint was,
+# so this script keeps its own record of how far it has read
+CHECKPOINT_READER = 'recent_contributors'
 
 
-def get_sorted_recent_posts():
-    posts = thread.new_posts()
-    for post in posts:
-        most_recent_posts[post.username] = post
+def read_new_pages(thread, archive, rescan=False):
+    """Read the thread from where this script last stopped, or from the
+    start if it never has or rescan is set. Every page read is archived by
+    the thread as it's parsed. The thread's config checkpoint is left alone,
+    since the trophy scanner relies on it."""
+    checkpoint = archive.checkpoint(thread.thread, CHECKPOINT_READER)
+    if rescan or checkpoint is None:
+        thread.page_number, thread.last_post = 1, 0
+    else:
+        thread.page_number, thread.last_post = checkpoint
+
+    for _post in thread.iter_new_posts(save_progress=False):
+        pass
 
-    return sorted(most_recent_posts.items(), key=by_time, reverse=True)
+    archive.save_checkpoint(thread.thread, CHECKPOINT_READER,
+                            thread.page_number, thread.last_post)
 
 
 dispatcher = Dispatcher()
 
 parser = argparse.ArgumentParser(
     description=('get a list of recent contributors to a thread, and the ' +
-                 'timestamp of their most recent post.')
+                 'timestamp of their most recent post. Posts are read into ' +
+                 'the thread archive, so later runs only read posts made ' +
+                 'since.')
 )
 use_single_thread_id_args(parser, dispatcher.default_thread)
+parser.add_argument(
+    '--rescan',
+    action='store_true',
+    help='if called, read the whole thread again')
+order = parser.add_mutually_exclusive_group()
+order.add_argument(
+    '--newest',
+    metavar='{count}',
+    type=int,
+    help='(optional) only list this many of the most recent contributors')
+order.add_argument(
+    '--oldest',
+    metavar='{count}',
+    type=int,
+    help=('(optional) only list this many of the least recent ' +
+          'contributors, least recent first'))
 
 if __name__ == '__main__':
     args = parser.parse_args()
+    archive = dispatcher.archive
+    if archive is None:
+        parser.error('archive_path must be set in config.ini')
 
     dispatcher.login(required=False)
 
     print("Preparing to scan thread for recent contributors.")
     thread = Thread(dispatcher=dispatcher, thread_id=args.thread_id)
     print(f"Reading thread: {thread.name}")
-    confirm = input("This may take a few minutes. Continue? (y/N)> ")
+
+    confirm = "y"
+    if args.rescan or archive.checkpoint(
+            thread.thread, CHECKPOINT_READER) is None:
+        confirm = input("This may take a few minutes. Continue? (y/N)> ")
     if confirm.lower() not in ["y", "yes"]:
         print("OK. Aborting.")
     else:
-        most_recent_posts = {}
-        sorted_recent_posts = get_sorted_recent_posts()
-
-        print("Most recent posts by each user (sorted by newest):")
-        for sorted_post in sorted_recent_posts:
-            user = sorted_post[0]
-            formatted_timestamp = datetime_formatted_est(
-                most_recent_posts[user].timestamp)
+        read_new_pages(thread, archive, rescan=args.rescan)
+
+        if args.oldest is not None:
+            print("Most recent posts by each user (sorted by oldest):")
+            recent_posts = archive.latest_post_per_user(
+                thread.thread, limit=args.oldest, oldest_first=True)
+        else:
+            print("Most recent posts by each user (sorted by newest):")
+            recent_posts = archive.latest_post_per_user(
+                thread.thread, limit=args.newest)
+
+        for user, timestamp in recent_posts:
+            formatted_timestamp = datetime_formatted_est(timestamp) \
+                if timestamp is not None else "unknown"
             print(f"{user}: {formatted_timestamp}")
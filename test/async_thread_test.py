@@ -0,0 +1,93 @@
+import asyncio
+
+import httpx
+import pytest
+
+from lib.async_dispatcher import AsyncDispatcher
+from lib.async_thread import AsyncThread
+
+CONFIG = """[DEFAULT]
+username =
+password =
+izgc_thread_id = 4020915
+requests_per_second = 1000
+page_cache_dir =
+archive_path =
+"""
+
+
+def make_page(page_number, post_count):
+    posts = "".join(f"""
+<table class="post" id="post{page_number}{index}" data-idx="{index}">
+  <tr><td class="userinfo"><dl><dt class="author">Imp{index}</dt></dl></td>
+    <td class="postbody">hi</td></tr>
+  <tr><td class="postdate"># ? Jan 2, 2023 14:05</td></tr>
+</table>""" for index in range(post_count))
+    return f"""<html><head><title>IZGC - The Something Awful Forums</title>
+</head><body data-thread="4020915">{posts}</body></html>"""
+
+
+def handle_request(request):
+    params = request.url.params
+    if params.get("goto") == "lastpost":
+        return httpx.Response(302, headers={
+            "Location": "showthread.php?threadid=4020915&pagenumber=2"})
+    page_number = int(params["pagenumber"])
+    if page_number > 2:
+        return httpx.Response(
+            200, text="The page number you requested does not exist")
+    return httpx.Response(200, text=make_page(
+        page_number, 40 if page_number == 1 else 3))
+
+
+@pytest.fixture(name="dispatcher")
+def fixture_dispatcher(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "config.ini").write_text(CONFIG, encoding="utf-8")
+    return AsyncDispatcher(transport=httpx.MockTransport(handle_request))
+
+
+@pytest.mark.parametrize("concurrency", [1, 4])
+def test_new_posts(dispatcher, concurrency):
+    async def read():
+        async with dispatcher:
+            thread = await AsyncThread.open(
+                dispatcher=dispatcher, thread_id="4020915")
+            thread.last_post = 38
+            return thread, await thread.new_posts(concurrency)
+
+    thread, posts = asyncio.run(read())
+    assert thread.name == "IZGC"
+    assert [post.username for post in posts] == \
+        ["Imp38", "Imp39", "Imp0", "Imp1", "Imp2"]
+    assert (thread.page_number, thread.last_post) == (2, 3)
+    assert dispatcher.config["4020915"]["last_post"] == "3"
+
+
+def test_anonymous_login_is_allowed(dispatcher, capsys):
+    async def login():
+        async with dispatcher:
+            await dispatcher.login(required=False)
+
+    asyncio.run(login())
+    assert not dispatcher.logged_in
+    assert capsys.readouterr().out != ""
+
+
+def test_failed_requests_are_retried(tmp_path, monkeypatch, mocker):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "config.ini").write_text(CONFIG, encoding="utf-8")
+    sleep = mocker.patch("lib.rate_limiter.asyncio.sleep")
+    responses = iter([
+        httpx.Response(503, headers={"Retry-After": "7"}),
+        httpx.Response(200, text="ok")])
+    dispatcher = AsyncDispatcher(
+        transport=httpx.MockTransport(lambda request: next(responses)))
+
+    async def get():
+        async with dispatcher:
+            return await dispatcher.get_thread(params={"threadid": "1"})
+
+    assert asyncio.run(get()).text == "ok"
+    # The Retry-After pause comes first; a short wait for a token may follow
+    assert sleep.call_args_list[0].args[0] == pytest.approx(7, abs=0.1)
@@ -0,0 +1,210 @@
+import hashlib
+import io
+from datetime import datetime, timezone
+
+import pytest
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import firestore
+from google.cloud.firestore_v1 import _helpers
+from google.cloud.firestore_v1.base_document import DocumentSnapshot
+
+from lib import bundle_generator
+
+COLLECTION_PATH = "imps/Jeffery/trophies2023"
+READ_TIME = datetime(2023, 5, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture(name="client")
+def fixture_client():
+    return firestore.Client(
+        project="imp-test", credentials=AnonymousCredentials())
+
+
+@pytest.fixture(name="generator")
+def fixture_generator(client, mocker, monkeypatch, tmp_path):
+    monkeypatch.delenv("BUNDLE_STORE_BUCKET", raising=False)
+    monkeypatch.setenv("BUNDLE_OUTPUT_DIR", str(tmp_path))
+    trophy_ref = client.document(f"{COLLECTION_PATH}/[Doom] Rip and Tear")
+    snapshot = DocumentSnapshot(
+        trophy_ref,
+        {"postUrl": "https://forums.somethingawful.com/ü",
+         "timestamp": READ_TIME,
+         "trophy": client.document("games/Doom/trophies/Rip and Tear")},
+        True, READ_TIME, READ_TIME, READ_TIME)
+    mocker.patch(
+        "google.cloud.firestore_v1.collection.CollectionReference.stream",
+        side_effect=lambda *args, **kwargs: iter([snapshot]))
+    handler = mocker.Mock(db_client=client, year=2023)
+    return bundle_generator.BundleGenerator(handler)
+
+
+def test_bundle_is_loadable(generator, client):
+    data = generator.generate_bundle(COLLECTION_PATH)
+    bundle = _helpers.deserialize_bundle(data["bundle"], client)
+    assert list(bundle.named_queries) == [COLLECTION_PATH]
+    assert len(bundle.documents) == 1
+
+
+def test_metadata_counts_bytes(generator):
+    data = generator.generate_bundle(COLLECTION_PATH)
+    raw = data["bundle"].encode("utf-8")
+    assert data["metadata"]["totalDocuments"] == 1
+    # everything after the length-prefixed metadata element counts
+    prefix = raw[:raw.index(b"{")]
+    metadata_end = len(prefix) + int(prefix)
+    assert len(raw) - metadata_end == data["metadata"]["totalBytes"]
+
+
+def test_stream_matches_generate(generator):
+    streamed = b"".join(generator.stream_bundle(COLLECTION_PATH))
+    generated = generator.generate_bundle(COLLECTION_PATH)["bundle"]
+    # createTime differs between the two, so compare everything after it
+    assert streamed.split(b'"version"', 1)[1] == \
+        generated.encode("utf-8").split(b'"version"', 1)[1]
+
+
+def test_stored_bundle_is_reused(generator, mocker):
+    imp_get = mocker.patch(
+        "google.cloud.firestore_v1.document.DocumentReference.get",
+        return_value=mocker.Mock(exists=True))
+    stored, _chunks = generator.open_bundle(COLLECTION_PATH)
+    reused, chunks = generator.open_bundle(COLLECTION_PATH)
+    assert reused == stored
+    imp_get.assert_called_once()
+    bundle = b"".join(chunks)
+    assert len(bundle) == stored.size
+    assert b"Rip and Tear" in bundle
+
+
+def test_bundle_without_store(generator, mocker):
+    mocker.patch(
+        "google.cloud.firestore_v1.document.DocumentReference.get",
+        return_value=mocker.Mock(exists=True))
+    generator.store = None
+    stored, chunks = generator.open_bundle(COLLECTION_PATH)
+    bundle = b"".join(chunks)
+    assert stored.size == len(bundle)
+    assert stored.etag == hashlib.sha256(bundle).hexdigest()
+    assert b"Rip and Tear" in bundle
+    generator.invalidate_bundles([COLLECTION_PATH])
+
+
+def test_no_bundle_for_missing_imp(generator, mocker):
+    mocker.patch(
+        "google.cloud.firestore_v1.document.DocumentReference.get",
+        return_value=mocker.Mock(exists=False))
+    assert generator.open_bundle(COLLECTION_PATH) == (None, None)
+    assert generator.store.get("imps_Jeffery_trophies2023") is None
+
+
+def test_invalidate_bundles(generator, mocker):
+    mocker.patch(
+        "google.cloud.firestore_v1.document.DocumentReference.get",
+        return_value=mocker.Mock(exists=True))
+    generator.open_bundle(COLLECTION_PATH)
+    generator.invalidate_bundles([COLLECTION_PATH])
+    assert generator.store.get("imps_Jeffery_trophies2023") is None
+
+
+def test_year_bundle_has_query_per_imp(generator, client, mocker):
+    snapshots = [
+        DocumentSnapshot(
+            client.document(f"imps/{imp}/trophies2023/[Doom] Rip and Tear"),
+            {"postUrl": "https://forums.somethingawful.com/"},
+            True, READ_TIME, READ_TIME, READ_TIME)
+        for imp in ("Jeffery", "Lowtax")]
+    mocker.patch(
+        "google.cloud.firestore_v1.query.CollectionGroup.stream",
+        side_effect=lambda *args, **kwargs: iter(snapshots))
+
+    with io.BytesIO() as out:
+        metadata = generator.write_year_bundle(out)
+        bundle = _helpers.deserialize_bundle(out.getvalue().decode(), client)
+
+    assert metadata["id"] == "trophies2023"
+    assert metadata["totalDocuments"] == 2
+    assert list(bundle.named_queries) == [
+        "trophies2023",
+        "imps/Jeffery/trophies2023",
+        "imps/Lowtax/trophies2023",
+    ]
+    assert bundle.named_queries["trophies2023"].bundled_query \
+        .structured_query.from_[0].all_descendants
+    assert len(bundle.documents) == 2
+
+
+def test_collection_versions(generator, client, mocker):
+    updated = datetime(2023, 6, 1, tzinfo=timezone.utc)
+    snapshots = [
+        DocumentSnapshot(
+            client.document(f"imps/{imp}/trophies2023/{name}"),
+            {}, True, READ_TIME, READ_TIME, update_time)
+        for imp, name, update_time in (
+            ("Jeffery", "[Doom] Rip and Tear", READ_TIME),
+            ("Jeffery", "[Doom] Knee Deep", updated),
+            ("Lowtax", "[Doom] Rip and Tear", READ_TIME))]
+    mocker.patch(
+        "google.cloud.firestore_v1.query.CollectionGroup.stream",
+        side_effect=lambda *args, **kwargs: iter(snapshots))
+
+    assert generator.get_collection_versions() == {
+        "imps/Jeffery/trophies2023": f"2@{updated}",
+        "imps/Lowtax/trophies2023": f"1@{READ_TIME}",
+    }
+
+
+class TestGenerateAllBundles:
+    @pytest.fixture(name="versions")
+    def fixture_versions(self, generator, mocker):
+        mocker.patch.object(generator, "get_all_imp_collections",
+                            return_value=[COLLECTION_PATH])
+        return mocker.patch.object(
+            generator, "get_collection_versions",
+            return_value={COLLECTION_PATH: "1@a"})
+
+    def test_unchanged_bundles_are_reused(self, generator, versions):
+        first = generator.generate_all_bundles()
+        assert first["regenerated_bundles"] == 1
+        [generated] = first["bundles"]
+        second = generator.generate_all_bundles()
+        assert second["regenerated_bundles"] == 0
+        [reused] = second["bundles"]
+        assert reused["data"]["bundle"] == generated["data"]["bundle"]
+        assert reused["document_count"] == 1
+        assert reused["size"] == generated["size"]
+
+    def test_bundles_are_generated_as_consumed(self, generator, versions,
+                                               mocker):
+        paths = [f"imps/Imp{i}/trophies2023" for i in range(20)]
+        generator.get_all_imp_collections.return_value = paths
+        versions.return_value = {}
+        generate = mocker.patch.object(
+            generator, "generate_bundle_info",
+            side_effect=lambda path, version: {"collection_path": path})
+
+        result = generator.generate_all_bundles()
+        assert result["total_bundles"] == result["regenerated_bundles"] == 20
+        bundles = result["bundles"]
+        assert next(bundles) == {"collection_path": paths[0]}
+        assert generate.call_count <= generator.max_workers + 1
+        assert [bundle["collection_path"] for bundle in bundles] == paths[1:]
+
+    def test_changed_bundles_are_rebuilt(self, generator, versions):
+        list(generator.generate_all_bundles()["bundles"])
+        versions.return_value = {COLLECTION_PATH: "2@b"}
+        result = generator.generate_all_bundles()
+        assert result["regenerated_bundles"] == 1
+        list(result["bundles"])
+        assert generator.store.get(
+            "imps_Jeffery_trophies2023").version == "2@b"
+
+    def test_full_rebuild(self, generator, versions):
+        list(generator.generate_all_bundles()["bundles"])
+        result = generator.generate_all_bundles(incremental=False)
+        assert result["regenerated_bundles"] == 1
+
+    def test_everything_is_built_without_store(self, generator, versions):
+        generator.store = None
+        list(generator.generate_all_bundles()["bundles"])
+        assert generator.generate_all_bundles()["regenerated_bundles"] == 1
+        versions.assert_not_called()
@@ -0,0 +1,74 @@
+import hashlib
+import io
+import time
+
+import pytest
+
+from lib.bundle_store import LocalBundleStore, bundle_name, make_bundle_store
+
+BUNDLE = b"123{}" * 30000
+
+
+@pytest.fixture(name="store")
+def fixture_store(tmp_path):
+    return LocalBundleStore(str(tmp_path / "bundles"))
+
+
+def test_bundle_name():
+    assert bundle_name("imps/Jeffery/trophies2023") == \
+        "imps_Jeffery_trophies2023"
+
+
+def test_missing(store):
+    assert store.get("imps_Jeffery_trophies2023") is None
+
+
+def test_round_trip(store):
+    stored = store.put("imps_Jeffery_trophies2023", io.BytesIO(BUNDLE))
+    assert stored.etag == hashlib.sha256(BUNDLE).hexdigest()
+    assert stored.size == len(BUNDLE)
+    assert store.get("imps_Jeffery_trophies2023") == stored
+    assert b"".join(store.iter_chunks("imps_Jeffery_trophies2023")) == BUNDLE
+
+
+def test_version_round_trip(store):
+    store.put("imps_Jeffery_trophies2023", io.BytesIO(BUNDLE), version="2@a")
+    assert store.get("imps_Jeffery_trophies2023").version == "2@a"
+
+
+def test_put_replaces(store):
+    store.put("imps_Jeffery_trophies2023", io.BytesIO(BUNDLE))
+    stored = store.put("imps_Jeffery_trophies2023", io.BytesIO(b"2{}"))
+    assert store.get("imps_Jeffery_trophies2023").etag == stored.etag
+    assert b"".join(store.iter_chunks("imps_Jeffery_trophies2023")) == b"2{}"
+
+
+def test_delete(store):
+    store.put("imps_Jeffery_trophies2023", io.BytesIO(BUNDLE))
+    store.delete("imps_Jeffery_trophies2023")
+    store.delete("imps_Jeffery_trophies2023")
+    assert store.get("imps_Jeffery_trophies2023") is None
+
+
+def test_expired_bundles_read_as_missing(tmp_path, monkeypatch):
+    store = LocalBundleStore(str(tmp_path), max_age=60)
+    store.put("imps_Jeffery_trophies2023", io.BytesIO(BUNDLE))
+    assert store.get("imps_Jeffery_trophies2023") is not None
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert store.get("imps_Jeffery_trophies2023") is None
+
+
+def test_make_bundle_store_local(monkeypatch, tmp_path):
+    monkeypatch.delenv("BUNDLE_STORE_BUCKET", raising=False)
+    monkeypatch.setenv("BUNDLE_OUTPUT_DIR", str(tmp_path))
+    store = make_bundle_store()
+    assert isinstance(store, LocalBundleStore)
+    assert store.directory == str(tmp_path)
+    assert store.max_age == 60 * 60
+
+
+def test_make_bundle_store_defaults_to_none(monkeypatch):
+    monkeypatch.delenv("BUNDLE_STORE_BUCKET", raising=False)
+    monkeypatch.delenv("BUNDLE_OUTPUT_DIR", raising=False)
+    assert make_bundle_store() is None
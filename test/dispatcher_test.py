@@ -83,3 +83,82 @@ def test_save_config_writes(dis, mocker):
     mocker.patch("builtins.open", mocker.mock_open(read_data=""))
     dis.save_config()
     write.assert_called_once()
+
+
+@pytest.fixture(name="retrying_dis")
+def fixture_retrying_dis(tmp_path, monkeypatch, mocker):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "config.ini").write_text(
+        "[DEFAULT]\nizgc_thread_id = 4020915\npage_cache_dir =\n"
+        "archive_path =\nmax_retries = 2\n", encoding="utf-8")
+    dis = dispatcher.Dispatcher()
+    dis.rate_limiter = mocker.Mock()
+    return dis
+
+
+def make_response(mocker, status_code, headers=None):
+    return mocker.Mock(status_code=status_code, headers=headers or {})
+
+
+class TestGetThreadRetries:
+    def test_success_is_not_retried(self, retrying_dis, mocker):
+        get = mocker.patch("lib.dispatcher.requests.Session.get",
+                           return_value=make_response(mocker, 200))
+        assert retrying_dis.get_thread(params={}).status_code == 200
+        assert get.call_args.kwargs["timeout"] == 30.0
+        retrying_dis.rate_limiter.record_response.assert_called_once()
+        retrying_dis.rate_limiter.back_off.assert_not_called()
+
+    def test_retry_after_is_respected(self, retrying_dis, mocker):
+        mocker.patch("lib.dispatcher.requests.Session.get", side_effect=[
+            make_response(mocker, 429, {"Retry-After": "7"}),
+            make_response(mocker, 200)])
+        assert retrying_dis.get_thread().status_code == 200
+        retrying_dis.rate_limiter.back_off.assert_called_once_with(7.0)
+
+    def test_errors_back_off_until_retries_run_out(
+            self, retrying_dis, mocker):
+        mocker.patch("lib.dispatcher.random.uniform", return_value=0.5)
+        mocker.patch("lib.dispatcher.requests.Session.get", side_effect=[
+            dispatcher.requests.Timeout(),
+            make_response(mocker, 503),
+            make_response(mocker, 503)])
+        assert retrying_dis.get_thread().status_code == 503
+        assert retrying_dis.rate_limiter.back_off.call_count == 2
+
+    def test_connection_errors_raise_when_retries_run_out(
+            self, retrying_dis, mocker):
+        mocker.patch("lib.dispatcher.random.uniform", return_value=0.5)
+        mocker.patch("lib.dispatcher.requests.Session.get",
+                     side_effect=dispatcher.requests.ConnectionError())
+        with pytest.raises(dispatcher.requests.ConnectionError):
+            retrying_dis.get_thread()
+
+
+def test_parse_retry_after():
+    assert dispatcher.parse_retry_after(None) is None
+    assert dispatcher.parse_retry_after("120") == 120.0
+    assert dispatcher.parse_retry_after("soon") is None
+    assert dispatcher.parse_retry_after(
+        "Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+
+class TestRetryPolicy:
+    def test_success_is_not_retried(self, mocker):
+        policy = dispatcher.RetryPolicy(max_retries=2)
+        assert policy.retry_delay(0, make_response(mocker, 200)) is None
+
+    def test_retry_after_is_capped(self, mocker):
+        policy = dispatcher.RetryPolicy(max_retries=2)
+        assert policy.retry_delay(0, make_response(
+            mocker, 429, {"Retry-After": "9999"})) == 120.0
+
+    def test_errors_back_off_until_retries_run_out(self, mocker):
+        mocker.patch("lib.dispatcher.random.uniform", return_value=0.5)
+        policy = dispatcher.RetryPolicy(max_retries=2)
+        assert policy.retry_delay(1, error=TimeoutError()) == 0.5
+        assert policy.retry_delay(2, error=TimeoutError()) is None
+
+
+def test_max_rate_defaults_to_rate(retrying_dis):
+    assert retrying_dis.settings.max_requests_per_second == 1.0
@@ -0,0 +1,168 @@
+from datetime import datetime, timezone
+
+from google.api_core import exceptions
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import firestore
+import pytest
+
+from lib.firebase_handler import FirebaseHandler
+
+
+TROPHY = {"reference": None, "link": "https://forums/post1",
+          "timestamp": None}
+
+
+@pytest.fixture(name="handler")
+def fixture_handler(mocker):
+    # A real client builds real references without touching the network
+    client = firestore.Client(
+        project="imp-tools-test", credentials=AnonymousCredentials())
+    mocker.patch.object(client, "batch")
+    handler = FirebaseHandler.__new__(FirebaseHandler)
+    handler.db_client = client
+    handler.year = 2023
+    handler.imp_cache_path = None
+    handler._imp_refs = {"Jeffery": client.document("imps/Jeffery")}
+    return handler
+
+
+def test_write_all_trophies_summary(handler):
+    summary = handler.write_all_trophies_to_db(
+        {"Jeffery": {"Doom": {"Rip and Tear": TROPHY, "Knee Deep": TROPHY}}})
+    assert summary == {"committed": 2, "failed": [],
+                       "collections": ["imps/Jeffery/trophies2023"]}
+
+
+class TestBatchedWrites:
+    def test_transient_errors_are_retried(self, handler, mocker):
+        sleep = mocker.patch("lib.firebase_handler.time.sleep")
+        handler.db_client.batch.return_value.commit.side_effect = [
+            exceptions.ServiceUnavailable("try again"), None]
+        assert handler.commit_batch([]) is True
+        sleep.assert_called_once()
+
+    def test_other_errors_are_not_retried(self, handler, mocker):
+        sleep = mocker.patch("lib.firebase_handler.time.sleep")
+        commit = handler.db_client.batch.return_value.commit
+        commit.side_effect = exceptions.PermissionDenied("no")
+        assert handler.commit_batch([]) is False
+        commit.assert_called_once()
+        sleep.assert_not_called()
+
+    def test_failed_summary_lists_trophies(self, handler, mocker):
+        mocker.patch.object(handler, "commit_batch", return_value=False)
+        summary = handler.write_all_trophies_to_db(
+            {"Jeffery": {"Doom": {"Rip and Tear": TROPHY}}})
+        assert summary == {
+            "committed": 0, "collections": [],
+            "failed": ["imps/Jeffery/trophies2023/[Doom] Rip and Tear"]}
+
+    def test_writes_are_split_into_batches(self, handler, mocker):
+        commit_batch = mocker.patch.object(
+            handler, "commit_batch", return_value=True)
+        handler.MAX_BATCH_WRITES = 2
+        summary = handler.write_all_trophies_to_db({"Jeffery": {"Doom": {
+            "Rip and Tear": TROPHY, "Knee Deep": TROPHY,
+            "Shores of Hell": TROPHY}}})
+        assert [len(call.args[0]) for call in commit_batch.call_args_list] \
+            == [2, 1]
+        assert summary["committed"] == 3
+
+
+def make_doc(mocker, path, data):
+    reference = mocker.Mock(path=path)
+    parent_path = path.rsplit("/", 2)[0] if path.count("/") > 1 else None
+    reference.parent.parent = \
+        mocker.Mock(path=parent_path) if parent_path else None
+    doc = mocker.Mock(id=path.rsplit("/", 1)[1], reference=reference,
+                      exists=True)
+    doc.to_dict.return_value = data
+    doc.get.side_effect = data.get
+    return doc
+
+
+@pytest.fixture(name="mock_handler")
+def fixture_mock_handler(mocker):
+    handler = FirebaseHandler.__new__(FirebaseHandler)
+    handler.db_client = mocker.Mock()
+    handler.db_client.document.side_effect = \
+        lambda path: mocker.Mock(path=path)
+    handler.year = 2023
+    handler.all_trophies_event_windows = []
+    handler._imp_refs = {}
+    return handler
+
+
+def test_prefetch_imps(mock_handler, mocker):
+    client = mock_handler.db_client
+    client.get_all.return_value = [make_doc(mocker, "imps/Jeffery", {})]
+    client.collection.return_value.where.return_value.stream.return_value = [
+        make_doc(mocker, "imps/abc123", {"currentUsername": "Imp"})]
+    mock_handler.prefetch_imps(["Jeffery", "Imp", "Nobody"])
+
+    assert client.get_all.call_count == 1
+    assert mock_handler._imp_refs["Jeffery"].path == "imps/Jeffery"
+    assert mock_handler._imp_refs["Imp"].path == "imps/abc123"
+    assert "Nobody" not in mock_handler._imp_refs
+
+
+def test_trophy_catalog_load(mock_handler, mocker):
+    start = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    end = datetime(2023, 2, 1, tzinfo=timezone.utc)
+    collections = {
+        "games": [make_doc(mocker, "games/Doom", {
+            "clubYear": 2023, "startTime": start, "endTime": end})],
+        "events": [make_doc(mocker, "events/Old", {"year": 2022})],
+    }
+    client = mock_handler.db_client
+    client.collection.side_effect = lambda name: mocker.Mock(
+        stream=mocker.Mock(return_value=collections[name]))
+    client.collection_group.return_value.stream.return_value = [
+        make_doc(mocker, "games/Doom/trophies/Rip and Tear",
+                 {"imageUrl": "https://impzone.club/doom.png"}),
+        make_doc(mocker, "events/Old/trophies/Old One",
+                 {"imageUrl": "https://impzone.club/old.png"}),
+    ]
+
+    catalog = mock_handler.get_trophy_dict_from_db()
+    assert list(catalog) == ["https://impzone.club/doom.png"]
+    trophy = catalog["https://impzone.club/doom.png"]
+    assert (trophy["game"], trophy["name"]) == ("Doom", "Rip and Tear")
+    assert (trophy["start_time"], trophy["end_time"]) == (start, end)
+
+
+def test_catalog_change_token(mock_handler, mocker):
+    counts = {"games": 3, "events": 2}
+    client = mock_handler.db_client
+
+    def count_query(value):
+        query = mocker.Mock()
+        query.count.return_value.get.return_value = [[mocker.Mock(
+            value=value)]]
+        return query
+
+    client.collection.side_effect = lambda name: count_query(counts[name])
+    client.collection_group.return_value = count_query(40)
+    client.document.side_effect = None
+    client.document.return_value.get.return_value = mocker.Mock(
+        update_time=datetime(2023, 5, 1, tzinfo=timezone.utc))
+    assert mock_handler.get_catalog_change_token() == \
+        "3|2|40|2023-05-01T00:00:00+00:00"
+    client.document.assert_called_once_with("meta/trophyCatalog")
+
+
+def test_has_catalog_year(mock_handler, mocker):
+    client = mock_handler.db_client
+    games, events = mocker.Mock(), mocker.Mock()
+    client.collection.side_effect = \
+        lambda name: {"games": games, "events": events}[name]
+    first_game = games.where.return_value.limit.return_value \
+        .select.return_value.stream
+    first_event = events.where.return_value.limit.return_value \
+        .select.return_value.stream
+    first_game.return_value = []
+    first_event.return_value = [make_doc(mocker, "events/Jam", {})]
+    assert mock_handler.has_catalog_year(2023) is True
+
+    first_event.return_value = []
+    assert mock_handler.has_catalog_year(99999) is False
@@ -0,0 +1,54 @@
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from app.routes.flag_redirects import FlagRedirectMiddleware
+
+
+class FakeFlagHandler:
+    def __init__(self, urls):
+        self.urls = urls
+
+    def get_random_flag_url(self, with_creator_metadata=False):
+        if not self.urls:
+            raise ValueError("No flag images available")
+        return self.urls[1 if with_creator_metadata else 0]
+
+
+def fallback_app(environ, start_response):
+    return Response("fallback", status=500)(environ, start_response)
+
+
+def make_client(urls):
+    return Client(FlagRedirectMiddleware(
+        fallback_app, FakeFlagHandler(urls),
+        {'/flag': False, '/flag-with-creator': True}))
+
+
+def test_redirects():
+    client = make_client(["https://a/flag.png", "https://a/flag.png?by=A"])
+    response = client.get('/flag')
+    assert response.status_code == 302
+    assert response.headers['Location'] == "https://a/flag.png"
+    assert response.headers['Cache-Control'].startswith('no-store')
+    response = client.get('/flag-with-creator')
+    assert response.headers['Location'] == "https://a/flag.png?by=A"
+
+
+def test_headers_reused():
+    client = make_client(["https://a/flag.png", "https://a/flag.png?by=A"])
+    client.get('/flag')
+    middleware = client.application
+    headers = middleware._headers["https://a/flag.png"]
+    client.get('/flag')
+    assert middleware._headers["https://a/flag.png"] is headers
+    assert len(headers) == 5
+
+
+def test_other_requests_passed_on():
+    client = make_client(["https://a/flag.png", "https://a/flag.png?by=A"])
+    assert client.get('/health').status_code == 500
+    assert client.post('/flag').status_code == 500
+
+
+def test_no_flags_passed_on():
+    assert make_client([]).get('/flag').status_code == 500
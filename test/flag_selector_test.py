@@ -0,0 +1,65 @@
+import random
+from collections import Counter
+
+import pytest
+
+from lib.flag_selector import AliasTable, FlagSelector
+from lib.flags import Flag
+
+
+def sample_counts(table, draws=20000):
+    rand = random.Random(1).random
+    return Counter(table.sample(rand) for _ in range(draws))
+
+
+def test_alias_table_follows_weights():
+    counts = sample_counts(AliasTable([1, 2, 1, 4]))
+    assert counts[3] / 20000 == pytest.approx(0.5, abs=0.02)
+    assert counts[1] / 20000 == pytest.approx(0.25, abs=0.02)
+    assert counts[0] / 20000 == pytest.approx(0.125, abs=0.02)
+
+
+def test_alias_table_single_weight():
+    assert set(sample_counts(AliasTable([3]), 100)) == {0}
+
+
+@pytest.mark.parametrize("weights", [[], [0, 0]])
+def test_alias_table_needs_weight(weights):
+    with pytest.raises(ValueError):
+        AliasTable(weights)
+
+
+def test_disabled_flags_never_chosen():
+    flags = [Flag("a.png", "A"), Flag("b.png", "B", disabled=True),
+             Flag("c.png", "C", weight=0)]
+    selector = FlagSelector(flags)
+    assert {selector.choose().name for _ in range(200)} == {"a.png"}
+
+
+def test_no_enabled_flags():
+    with pytest.raises(ValueError):
+        FlagSelector([Flag("b.png", "B", disabled=True)])
+
+
+def test_creator_fairness():
+    flags = [Flag(f"a{i}.png", "A") for i in range(9)] + [Flag("b.png", "B")]
+    selector = FlagSelector(flags, creator_fairness=True)
+    random.seed(2)
+    counts = Counter(selector.choose().by for _ in range(10000))
+    assert counts["B"] / 10000 == pytest.approx(0.5, abs=0.03)
+
+
+def test_recent_flags_not_repeated():
+    flags = [Flag(f"{i}.png", str(i)) for i in range(10)]
+    selector = FlagSelector(flags, recent_window=3)
+    random.seed(3)
+    served = [selector.choose().name for _ in range(500)]
+    repeats = sum(served[i] in served[i - 3:i] for i in range(3, len(served)))
+    # a redraw can still land on a recent flag, but only rarely
+    assert repeats < 5
+
+
+def test_recent_window_is_capped():
+    selector = FlagSelector([Flag("a.png", "A"), Flag("b.png", "B")],
+                            recent_window=10)
+    assert selector.recent_window == 1
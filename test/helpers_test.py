@@ -0,0 +1,23 @@
+import pytest
+
+from lib.helpers import atomic_write
+
+
+def test_atomic_write_replaces_file(tmp_path):
+    path = tmp_path / "snapshot.json"
+    path.write_text("old")
+    with atomic_write(str(path), "w", encoding="utf-8") as file:
+        file.write("new")
+    assert path.read_text() == "new"
+    assert [p.name for p in tmp_path.iterdir()] == ["snapshot.json"]
+
+
+def test_failed_atomic_write_leaves_file_alone(tmp_path):
+    path = tmp_path / "snapshot.json"
+    path.write_text("old")
+    with pytest.raises(ValueError):
+        with atomic_write(str(path)) as file:
+            file.write(b"half")
+            raise ValueError()
+    assert path.read_text() == "old"
+    assert [p.name for p in tmp_path.iterdir()] == ["snapshot.json"]
@@ -0,0 +1,33 @@
+from lib import page_cache
+
+KEY = ("anonymous", 4020915, 12, 40)
+
+
+def test_missing_page_returns_none(tmp_path):
+    cache = page_cache.PageCache(str(tmp_path))
+    assert cache.get(KEY) is None
+
+
+def test_put_then_get_round_trips(tmp_path):
+    cache = page_cache.PageCache(str(tmp_path))
+    cache.put(KEY, page_cache.CachedPage(html="<html>imps</html>",
+                                         etag='"abc"'))
+    cached = cache.get(KEY)
+    assert cached.html == "<html>imps</html>"
+    assert cached.etag == '"abc"'
+    assert not cached.complete
+
+
+def test_mark_complete(tmp_path):
+    cache = page_cache.PageCache(str(tmp_path))
+    cache.put(KEY, page_cache.CachedPage(html="<html></html>"))
+    cache.mark_complete(KEY)
+    assert cache.get(KEY).complete
+
+
+def test_revalidation_headers():
+    cached = page_cache.CachedPage(
+        html="", etag='"abc"', last_modified="Sat, 01 Jan 2022 00:00:00 GMT")
+    assert cached.revalidation_headers() == {
+        "If-None-Match": '"abc"',
+        "If-Modified-Since": "Sat, 01 Jan 2022 00:00:00 GMT"}
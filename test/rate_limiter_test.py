@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from lib import rate_limiter
+
+
+def test_invalid_rate_errors():
+    with pytest.raises(ValueError):
+        rate_limiter.RateLimiter(0)
+
+
+def test_first_call_does_not_wait(mocker):
+    sleep = mocker.patch("lib.rate_limiter.time.sleep")
+    rate_limiter.RateLimiter(1).wait()
+    sleep.assert_not_called()
+
+
+def test_back_to_back_calls_are_spaced_out(mocker):
+    mocker.patch("lib.rate_limiter.time.monotonic", return_value=100.0)
+    sleep = mocker.patch("lib.rate_limiter.time.sleep")
+    limiter = rate_limiter.RateLimiter(2)
+    limiter.wait()
+    limiter.wait()
+    limiter.wait()
+    assert [call.args[0] for call in sleep.call_args_list] == [0.5, 1.0]
+
+
+def test_token_bucket_allows_burst_then_waits(mocker):
+    mocker.patch("lib.rate_limiter.time.monotonic", return_value=100.0)
+    sleep = mocker.patch("lib.rate_limiter.asyncio.sleep")
+    bucket = rate_limiter.AsyncTokenBucket(2, capacity=2)
+
+    async def acquire(count):
+        for _ in range(count):
+            await bucket.acquire()
+
+    asyncio.run(acquire(3))
+    assert [call.args[0] for call in sleep.call_args_list] == [0.5]
+
+
+def test_adaptive_rate_speeds_up_and_backs_off(mocker):
+    mocker.patch("lib.rate_limiter.time.monotonic", return_value=100.0)
+    limiter = rate_limiter.AdaptiveRateLimiter(1, max_rate=2, step=0.5)
+    limiter.record_response(0.1)
+    limiter.record_response(0.1)
+    limiter.record_response(0.1)
+    assert limiter.rate == 2
+    assert limiter.interval == 0.5
+
+    limiter.record_response(5)
+    assert limiter.rate == 1
+    limiter.back_off(10)
+    assert limiter.rate == 0.5
+    sleep = mocker.patch("lib.rate_limiter.time.sleep")
+    limiter.wait()
+    sleep.assert_called_once_with(10)
+
+
+def test_adaptive_token_bucket_backs_off(mocker):
+    mocker.patch("lib.rate_limiter.time.monotonic", return_value=100.0)
+    sleep = mocker.patch("lib.rate_limiter.asyncio.sleep")
+    bucket = rate_limiter.AdaptiveAsyncTokenBucket(2, max_rate=4, step=1)
+    bucket.record_response(0.1)
+    assert bucket.rate == 3
+    bucket.back_off(10)
+    assert bucket.rate == 1.5
+
+    asyncio.run(bucket.acquire())
+    sleep.assert_called_once_with(10)
+
+
+def test_rate_does_not_adapt_without_max_rate():
+    limiter = rate_limiter.AdaptiveRateLimiter(1)
+    limiter.record_response(0.1)
+    assert limiter.rate == 1
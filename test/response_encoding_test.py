@@ -0,0 +1,42 @@
+import gzip
+
+import brotli
+import pytest
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header
+
+from lib.response_encoding import choose_encoding, compress_chunks
+
+CHUNKS = [b'{"bundles": [', b'"a"' * 5000, b', "b"', b']}']
+
+
+def accept(header):
+    return parse_accept_header(header, Accept)
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("", None),
+    ("identity", None),
+    ("gzip", "gzip"),
+    ("gzip, deflate, br", "br"),
+    ("br;q=0.5, gzip", "gzip"),
+    ("*", "br"),
+    ("gzip;q=0", None),
+])
+def test_choose_encoding(header, expected):
+    assert choose_encoding(accept(header)) == expected
+
+
+def test_gzip_round_trip():
+    compressed = b"".join(compress_chunks(iter(CHUNKS), "gzip"))
+    assert gzip.decompress(compressed) == b"".join(CHUNKS)
+
+
+def test_brotli_round_trip():
+    compressed = b"".join(compress_chunks(iter(CHUNKS), "br"))
+    assert brotli.decompress(compressed) == b"".join(CHUNKS)
+
+
+def test_unsupported_encoding():
+    with pytest.raises(ValueError):
+        list(compress_chunks(iter(CHUNKS), "deflate"))
@@ -0,0 +1,83 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from lib.thread_archive import ThreadArchive
+from lib.thread_reader import Post
+
+TROPHY_URL = "https://i.imgur.com/trophy.png"
+
+
+def make_post(post_id, username, timestamp, images=(), quoted_images=()):
+    return Post(
+        username=username, post_id=post_id, index=post_id, avatar_url="",
+        is_unread=False, raw_timestamp=timestamp, text="", unquoted_text="",
+        image_urls=tuple(quoted_images) + tuple(images),
+        unquoted_image_urls=tuple(images))
+
+
+@pytest.fixture(name="archive")
+def fixture_archive(tmp_path):
+    archive = ThreadArchive(str(tmp_path / "archive.sqlite3"))
+    archive.save_thread("4020915", "IZGC")
+    archive.save_page("4020915", 1, [
+        make_post("1", "Jeffery", "# ? Jan 2, 2024 14:05", [TROPHY_URL]),
+        make_post("2", "Imp", "# ? Jan 3, 2024 14:05",
+                  quoted_images=[TROPHY_URL]),
+        make_post("3", "Jeffery", "# ? Jan 4, 2023 14:05", [TROPHY_URL]),
+    ])
+    yield archive
+    archive.close()
+
+
+def test_latest_post_per_user(archive):
+    latest = archive.latest_post_per_user("4020915")
+    assert [username for username, _timestamp in latest] == \
+        ["Imp", "Jeffery"]
+    assert latest[1][1].day == 2
+
+
+def test_latest_post_per_user_limited(archive):
+    archive.save_page("4020915", 2, [make_post("4", "Lurker", None)])
+    assert [username for username, _timestamp in archive.latest_post_per_user(
+        "4020915", limit=1)] == ["Imp"]
+    assert [username for username, _timestamp in archive.latest_post_per_user(
+        "4020915", oldest_first=True)] == ["Jeffery", "Imp", "Lurker"]
+
+
+def test_posts_with_images(archive):
+    posts = archive.posts_with_images([TROPHY_URL])
+    assert [post_id for _user, post_id, _time, _url in posts] == ["3", "1"]
+
+
+def test_posts_with_images_between(archive):
+    posts = archive.posts_with_images(
+        [TROPHY_URL], start=datetime(2024, 1, 1, tzinfo=timezone.utc),
+        end=datetime(2025, 1, 1, tzinfo=timezone.utc), include_quoted=True)
+    assert [post_id for _user, post_id, _time, _url in posts] == ["1", "2"]
+
+
+def test_saving_page_again_replaces_it(archive):
+    archive.save_page("4020915", 1, [
+        make_post("1", "Jeffery", "# ? Jan 2, 2024 14:05")])
+    assert archive.last_archived_page("4020915") == (1, 1)
+    assert archive.posts_with_images([TROPHY_URL]) == []
+    assert archive.latest_post_per_user("4020915")[0][0] == "Jeffery"
+
+
+def test_missing_timestamp(archive):
+    archive.save_page("4020915", 2, [make_post("4", "Lurker", None)])
+    assert ("Lurker", None) in archive.latest_post_per_user("4020915")
+
+
+def test_nothing_archived(archive):
+    assert archive.last_archived_page("123") is None
+
+
+def test_checkpoints_are_per_reader(archive):
+    assert archive.checkpoint("4020915", "recent_contributors") is None
+    archive.save_checkpoint("4020915", "recent_contributors", 1, 3)
+    archive.save_checkpoint("4020915", "recent_contributors", 2, 0)
+    assert archive.checkpoint("4020915", "recent_contributors") == (2, 0)
+    assert archive.checkpoint("4020915", "snipe_countdown") is None
+    assert archive.checkpoint("123", "recent_contributors") is None
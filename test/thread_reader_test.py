@@ -0,0 +1,145 @@
+import pickle
+
+import pytest
+
+from lib import page_cache, thread_reader
+
+RAW_PAGE = """
+<html><head><title>IZGC - The Something Awful Forums</title></head>
+<body data-thread="4020915">
+<select><option value="1">1</option>
+<option value="2" selected="selected">2</option></select>
+<table class="post" id="post111" data-idx="41">
+  <tr class="altcolor1">
+    <td class="userinfo userid-1"><dl><dt class="author">Jeffery</dt>
+      <dd class="title"><img src="https://i.imgur.com/avatar.png"></dd></dl>
+    </td>
+    <td class="postbody">
+      <div class="bbc-block"><img src="https://i.imgur.com/quoted.png"></div>
+      Got one! <img src="https://i.imgur.com/trophy.png">
+    </td>
+  </tr>
+  <tr class="altcolor1"><td class="postdate"># ? Jan 2, 2023 14:05</td></tr>
+</table>
+<table class="post" id="post112" data-idx="42">
+  <tr class="seen2">
+    <td class="userinfo userid-2"><dl><dt class="author">Adbot</dt></dl></td>
+    <td class="postbody">Buy things</td>
+  </tr>
+  <tr class="seen2"><td class="postdate"># ? Jan 2, 2023 14:06</td></tr>
+</table>
+<table class="post" id="post113" data-idx="43">
+  <tr class="seen1">
+    <td class="userinfo userid-3"><dl><dt class="author">Imp</dt></dl></td>
+    <td class="postbody">no trophies here</td>
+  </tr>
+  <tr class="seen1"><td class="postdate"># ? Jan 2, 2023 2:07 PM</td></tr>
+</table>
+</body></html>
+"""
+
+ENGINES = [
+    engine for engine in thread_reader.PARSER_ENGINES
+    if engine != "lxml" or thread_reader.lxml_html is not None]
+
+
+@pytest.fixture(name="page", params=ENGINES)
+def fixture_page(request):
+    return thread_reader.Page(RAW_PAGE, request.param)
+
+
+def test_unknown_engine_errors():
+    with pytest.raises(ValueError):
+        thread_reader.Page(RAW_PAGE, "regex")
+
+
+class TestPage:
+    def test_page_attributes(self, page):
+        assert page.thread == "4020915"
+        assert page.number == 2
+
+    def test_adbot_skipped(self, page):
+        assert [post.username for post in page.posts] == ["Jeffery", "Imp"]
+
+    def test_read_state(self, page):
+        assert [post.username for post in page.unread_posts] == ["Jeffery"]
+        assert [post.username for post in page.read_posts] == ["Imp"]
+
+
+class TestPost:
+    def test_post_fields(self, page):
+        post = page.posts[0]
+        assert post.post_id == "111"
+        assert post.index == "41"
+        assert post.avatar_url == "https://i.imgur.com/avatar.png"
+        assert page.posts[1].avatar_url == ""
+
+    def test_timestamps(self, page):
+        assert page.posts[0].timestamp.hour == page.posts[1].timestamp.hour
+
+    def test_remove_quotes(self, page):
+        post = page.posts[0]
+        assert len(post.image_urls()) == 2
+        post.remove_quotes()
+        assert post.image_urls() == ["https://i.imgur.com/trophy.png"]
+        assert "Got one!" in post.text
+
+    def test_posts_pickle_without_parse_tree(self, page):
+        post = pickle.loads(pickle.dumps(page.posts[0]))
+        assert post.username == "Jeffery"
+        assert post.timestamp == page.posts[0].timestamp
+        assert not hasattr(page, "soup")
+
+
+def test_prefetched_new_posts_continue_onto_next_page(mocker):
+    thread = thread_reader.Thread.__new__(thread_reader.Thread)
+    thread.dispatcher = mocker.Mock(logged_in=False, page_cache=None)
+    thread.thread = "4020915"
+    thread.name = "IZGC"
+    thread.parser_engine = "html.parser"
+    thread.page_number = 1
+    thread.last_post = 38
+    pages = {"page 1": [f"post {index}" for index in range(40)],
+             "page 2": ["post 40", "post 41"]}
+    mocker.patch.object(thread, "get_last_page_number", return_value=2)
+    mocker.patch.object(thread, "fetch_raw_pages",
+                        return_value=[(1, "page 1"), (2, "page 2")])
+    mocker.patch("lib.thread_reader.Page",
+                 side_effect=lambda raw_page, *_args: mocker.Mock(
+                     posts=pages[raw_page]))
+    mocker.patch.object(thread, "update_config_values")
+
+    posts = thread.new_posts(workers=2)
+    assert posts == ["post 38", "post 39", "post 40", "post 41"]
+    assert (thread.page_number, thread.last_post) == (2, 2)
+
+
+def test_page_cache_helpers(mocker, tmp_path):
+    dispatcher = mocker.Mock(
+        logged_in=False, archive=None, config={"DEFAULT": {}},
+        page_cache=page_cache.PageCache(str(tmp_path)))
+    thread = thread_reader.BaseThread(
+        dispatcher=dispatcher, thread_id="4020915")
+    assert thread.get_cached_page(2) is None
+
+    fresh = mocker.Mock(status_code=200, text=RAW_PAGE,
+                        headers={"ETag": '"abc"'})
+    assert thread.page_html_from_response(2, fresh, None) == RAW_PAGE
+    cached = thread.get_cached_page(2)
+    assert cached.etag == '"abc"' and not cached.complete
+
+    not_modified = mocker.Mock(status_code=304, text="", headers={})
+    assert thread.page_html_from_response(2, not_modified, cached) == \
+        RAW_PAGE
+
+
+def test_advance_past_page(mocker):
+    thread = thread_reader.BaseThread(
+        dispatcher=mocker.Mock(config={"DEFAULT": {}}), thread_id="4020915")
+    thread.page_number, thread.last_post = 3, 38
+    full_page = mocker.Mock(posts=list(range(40)))
+    assert thread.new_posts_on_page(full_page) == [38, 39]
+    thread.advance_past_page(3, full_page)
+    assert (thread.page_number, thread.last_post) == (4, 0)
+    thread.advance_past_page(4, mocker.Mock(posts=[0, 1]))
+    assert (thread.page_number, thread.last_post) == (4, 2)
@@ -0,0 +1,41 @@
+from datetime import datetime
+
+import pytest
+
+from lib import time_windows
+
+
+def window(start_day, end_day):
+    return {"start_time": datetime(2023, 1, start_day),
+            "end_time": datetime(2023, 1, end_day)}
+
+
+@pytest.fixture(name="index")
+def fixture_index():
+    return time_windows.TimeWindowIndex([
+        window(20, 25), window(1, 5), window(3, 8), window(8, 10)])
+
+
+def test_overlapping_windows_merge(index):
+    assert index.starts == [datetime(2023, 1, 1), datetime(2023, 1, 8),
+                            datetime(2023, 1, 20)]
+    assert len(index) == 3
+
+
+@pytest.mark.parametrize("day, expected", [
+    (1, False), (2, True), (7, True), (8, False), (9, True), (10, False),
+    (15, False), (21, True), (25, False), (31, False)])
+def test_contains(index, day, expected):
+    assert index.contains(datetime(2023, 1, day)) is expected
+
+
+def test_contains_many_matches_contains(index):
+    timestamps = [datetime(2023, 1, day) for day in (31, 2, 8, 21, 1, 9)]
+    assert index.contains_many(timestamps) == [
+        index.contains(timestamp) for timestamp in timestamps]
+
+
+def test_empty_index():
+    index = time_windows.TimeWindowIndex([])
+    assert not index.contains(datetime(2023, 1, 1))
+    assert index.contains_many([datetime(2023, 1, 1)]) == [False]
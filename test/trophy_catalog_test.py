@@ -0,0 +1,58 @@
+from datetime import datetime, timezone
+
+from lib import trophy_catalog
+
+
+class FakeReference:
+    def __init__(self, path):
+        self.path = path
+
+
+TROPHIES = {
+    "https://impzone.club/trophies/a.png": {
+        "game": "Doom",
+        "name": "Rip and Tear",
+        "reference": FakeReference("games/Doom/trophies/Rip and Tear"),
+        "start_time": datetime(2023, 1, 1, 5, tzinfo=timezone.utc),
+        "end_time": datetime(2024, 1, 1, 5, tzinfo=timezone.utc),
+    }
+}
+WINDOWS = [{"start_time": datetime(2023, 12, 1, tzinfo=timezone.utc),
+            "end_time": datetime(2023, 12, 26, tzinfo=timezone.utc)}]
+
+
+def test_missing_snapshot_loads_nothing(tmp_path):
+    snapshot = trophy_catalog.TrophyCatalogSnapshot(
+        str(tmp_path / "catalog.json"))
+    assert snapshot.load(2023, "token", FakeReference) is None
+
+
+def test_round_trip(tmp_path):
+    snapshot = trophy_catalog.TrophyCatalogSnapshot(
+        str(tmp_path / "catalog.json"))
+    snapshot.save(2023, "token", TROPHIES, WINDOWS)
+    trophies, windows = snapshot.load(2023, "token", FakeReference)
+    trophy = trophies["https://impzone.club/trophies/a.png"]
+    assert trophy["reference"].path == "games/Doom/trophies/Rip and Tear"
+    assert trophy["start_time"] == TROPHIES[
+        "https://impzone.club/trophies/a.png"]["start_time"]
+    assert windows == WINDOWS
+
+
+def test_changed_token_loads_nothing(tmp_path):
+    snapshot = trophy_catalog.TrophyCatalogSnapshot(
+        str(tmp_path / "catalog.json"))
+    snapshot.save(2023, "token", TROPHIES, WINDOWS)
+    assert snapshot.load(2023, "new token", FakeReference) is None
+    assert snapshot.load(2022, "token", FakeReference) is None
+
+
+def test_expired_snapshot_loads_nothing(tmp_path, mocker):
+    path = str(tmp_path / "data" / "catalog.json")
+    trophy_catalog.TrophyCatalogSnapshot(path).save(
+        2023, "token", TROPHIES, WINDOWS)
+    snapshot = trophy_catalog.TrophyCatalogSnapshot(path, max_age=60)
+    assert snapshot.load(2023, "token", FakeReference) is not None
+    mocker.patch("lib.trophy_catalog.time.time",
+                 return_value=trophy_catalog.time.time() + 61)
+    assert snapshot.load(2023, "token", FakeReference) is None
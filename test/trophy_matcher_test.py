@@ -0,0 +1,52 @@
+from lib import trophy_matcher
+
+TROPHY = "https://impzone.club/trophies/beat-the-game.png"
+RELATIVE_TROPHY = "images/trophies/secret.png"
+
+
+def test_normalize_url_ignores_scheme_www_and_query():
+    assert trophy_matcher.normalize_url(
+        "http://WWW.impzone.club/trophies/a.png?v=2#top"
+    ) == "impzone.club/trophies/a.png"
+
+
+def test_normalize_relative_url_is_none():
+    assert trophy_matcher.normalize_url(RELATIVE_TROPHY) is None
+
+
+class TestTrophyMatcher:
+    matcher = trophy_matcher.TrophyMatcher([TROPHY, RELATIVE_TROPHY])
+
+    def test_exact_match(self):
+        assert self.matcher.match(TROPHY) == [TROPHY]
+
+    def test_normalized_match(self):
+        assert self.matcher.match(
+            "http://www.impzone.club/trophies/beat-the-game.png?1"
+        ) == [TROPHY]
+
+    def test_substring_match(self):
+        assert self.matcher.match(
+            "https://impzone.club/images/trophies/secret.png"
+        ) == [RELATIVE_TROPHY]
+
+    def test_urls_are_not_regexes(self):
+        assert self.matcher.match(
+            "https://impzone.club/images/trophies/secretXpng") == []
+
+    def test_no_match(self):
+        assert self.matcher.match("https://i.imgur.com/cat.png") == []
+
+    def test_empty_matcher(self):
+        assert trophy_matcher.TrophyMatcher([]).match(TROPHY) == []
+
+    def test_exact_match_skips_substring_search(self):
+        matcher = trophy_matcher.TrophyMatcher([TROPHY, "beat-the-game"])
+        assert matcher.match(TROPHY) == [TROPHY]
+
+    def test_overlapping_substrings_all_match(self):
+        matcher = trophy_matcher.TrophyMatcher(
+            ["trophies/secret", "trophies/secret.png", "secret.png"])
+        assert matcher.match(
+            "https://impzone.club/images/trophies/secret.png") == [
+                "trophies/secret.png", "trophies/secret", "secret.png"]
@@ -0,0 +1,71 @@
+import pickle
+
+import pytest
+
+from lib import thread_reader, trophy_page_parser
+
+TROPHY_URL = "https://i.imgur.com/trophy.png"
+
+
+def make_page(page_number, posts=2):
+    tables = "".join(f"""
+<table class="post" id="post{page_number}{i}" data-idx="{i}">
+  <tr class="altcolor1">
+    <td class="userinfo userid-1"><dl><dt class="author">Imp {i}</dt></dl>
+    </td>
+    <td class="postbody">
+      <div class="bbc-block"><img src="{TROPHY_URL}"></div>
+      {f'<img src="{TROPHY_URL}">' if i == 0 else 'quoting a trophy'}
+    </td>
+  </tr>
+  <tr class="altcolor1"><td class="postdate"># ? Jan 2, 2023 14:05</td></tr>
+</table>""" for i in range(posts))
+    return (f'<html><body data-thread="4020915">{tables}</body></html>')
+
+
+@pytest.fixture(name="worker", autouse=True)
+def fixture_worker():
+    trophy_page_parser.init_worker("html.parser", [TROPHY_URL])
+
+
+def test_parse_trophy_page():
+    page = trophy_page_parser.parse_trophy_page(make_page(3))
+    assert [post.username for post in page.posts] == ["Imp 0", "Imp 1"]
+    # the second post only has the trophy in a quote
+    assert [post.trophy_keys for post in page.posts] == [(TROPHY_URL,), ()]
+    assert page.posts[0].timestamp.year == 2023
+    assert page.posts[0].link.endswith("#post30")
+
+
+def test_results_pickle():
+    page = trophy_page_parser.parse_trophy_page(make_page(3))
+    post = pickle.loads(pickle.dumps(page)).posts[0]
+    assert (post.username, post.post_id, post.trophy_keys) == \
+        ("Imp 0", "30", (TROPHY_URL,))
+
+
+def test_missing_timestamp():
+    post = trophy_page_parser.TrophyPost("Imp", "1", None, ())
+    with pytest.raises(thread_reader.TimestampParsingError):
+        _ = post.timestamp
+
+
+def test_pages_parsed_in_processes_keep_order(mocker):
+    thread = object.__new__(thread_reader.Thread)
+    thread.name = "IZGC"
+    thread.page_number = 1
+    thread.dispatcher = mocker.Mock(page_cache=None)
+    mocker.patch.object(thread, "get_last_page_number", return_value=6)
+    raw_pages = [(n, make_page(n)) for n in range(1, 6)] + \
+        [(6, "The page number you requested is out of range")]
+    mocker.patch.object(thread, "fetch_raw_pages",
+                        return_value=(page for page in raw_pages))
+
+    pages = list(thread.iter_pages_in_processes(
+        trophy_page_parser.parse_trophy_page, processes=2,
+        initializer=trophy_page_parser.init_worker,
+        initargs=("html.parser", [TROPHY_URL])))
+
+    assert [number for number, _page in pages] == [1, 2, 3, 4, 5]
+    assert [page.posts[0].post_id for _number, page in pages] == \
+        ["10", "20", "30", "40", "50"]
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 import pytest
 
 from lib import trophy_scanner
@@ -20,3 +22,34 @@ class TestTrophyReporter:
             mocker.mock_open(read_data=""),
             side_effect=FileNotFoundError()
         )
+
+
+def test_db_handler_is_created_on_first_use(mocker):
+    handler_class = mocker.patch.object(trophy_scanner, "FirebaseHandler")
+    mocker.patch.object(trophy_scanner, "_fb_handler", None)
+    handler_class.assert_not_called()
+    assert trophy_scanner.get_fb_handler() is trophy_scanner.get_fb_handler()
+    handler_class.assert_called_once()
+
+
+def test_matched_trophies_are_checked_in_bulk(mocker):
+    def trophy(name, start_day, end_day):
+        return {"game": "Doom", "name": name, "reference": name,
+                "start_time": datetime(2023, 1, start_day),
+                "end_time": datetime(2023, 1, end_day)}
+
+    thread = trophy_scanner.IZGCThread.__new__(trophy_scanner.IZGCThread)
+    thread.fb_handler = mocker.Mock(eligible_trophies={
+        "early": trophy("Early", 1, 5), "late": trophy("Late", 20, 25)})
+    thread._all_trophies_windows = trophy_scanner.TimeWindowIndex(
+        [{"start_time": datetime(2023, 1, 9),
+          "end_time": datetime(2023, 1, 12)}])
+    posts = [mocker.Mock(timestamp=datetime(2023, 1, day), link=str(day))
+             for day in (2, 10, 15)]
+    matched_posts = [(post, ["early", "late"]) for post in posts]
+
+    earned = thread.get_matched_trophies_many(matched_posts)
+    assert earned == [(post, thread.get_matched_trophies(post, paths))
+                      for post, paths in matched_posts]
+    assert [sorted(trophies.get("Doom", {})) for _post, trophies in earned] \
+        == [["Early"], ["Early", "Late"], []]